@@ -0,0 +1,62 @@
+"""Add lookup indexes.
+
+Revision ID: 0b0d67280891
+Revises: 452e0a651241
+Create Date: 2026-10-18 10:50:15.731661
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0b0d67280891'
+down_revision = '452e0a651241'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_shortlink_user_id'),
+                              ['user_id'], unique=False)
+
+    # Only the start of the URL is indexed on MySQL due to the key length
+    # limit
+    with op.batch_alter_table('url', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_url_short_link_id'),
+                              ['short_link_id'], unique=False)
+        batch_op.create_index('ix_url_url', ['url', 'short_link_id'],
+                              unique=False, mysql_length={'url': 255})
+
+    with op.batch_alter_table('paste', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_paste_short_link_id'),
+                              ['short_link_id'], unique=False)
+        batch_op.create_index('ix_paste_hash', ['hash', 'short_link_id'],
+                              unique=False)
+
+    with op.batch_alter_table('upload', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_upload_short_link_id'),
+                              ['short_link_id'], unique=False)
+        batch_op.create_index('ix_upload_hash', ['hash', 'short_link_id'],
+                              unique=False)
+        batch_op.create_index('ix_upload_filename', ['filename'],
+                              unique=False, mysql_length={'filename': 255})
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    with op.batch_alter_table('upload', schema=None) as batch_op:
+        batch_op.drop_index('ix_upload_filename')
+        batch_op.drop_index('ix_upload_hash')
+        batch_op.drop_index(batch_op.f('ix_upload_short_link_id'))
+
+    with op.batch_alter_table('paste', schema=None) as batch_op:
+        batch_op.drop_index('ix_paste_hash')
+        batch_op.drop_index(batch_op.f('ix_paste_short_link_id'))
+
+    with op.batch_alter_table('url', schema=None) as batch_op:
+        batch_op.drop_index('ix_url_url')
+        batch_op.drop_index(batch_op.f('ix_url_short_link_id'))
+
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_shortlink_user_id'))
@@ -0,0 +1,103 @@
+"""Compress large pastes.
+
+Revision ID: 5d2e8b4c7a13
+Revises: c3f1a7d52e90
+Create Date: 2026-10-18 11:06:41.215094
+"""
+from alembic import op
+import sqlalchemy as sa
+import zlib
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8b4c7a13'
+down_revision = 'c3f1a7d52e90'
+branch_labels = None
+depends_on = None
+
+
+# Pastes at least this many bytes long are compressed
+COMPRESS_THRESHOLD = 1024
+
+# The number of pastes to read at a time
+BATCH_SIZE = 500
+
+paste_table = sa.Table(
+    'paste',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('code', sa.Text(), nullable=True),
+    sa.Column('compressed_code', sa.LargeBinary(), nullable=True)
+)
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    with op.batch_alter_table('paste', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('compressed_code', sa.LargeBinary(),
+                                      nullable=True))
+        batch_op.alter_column('code', existing_type=sa.Text(),
+                              nullable=True)
+
+    # Compress the existing large pastes, a page at a time so that they
+    # aren't all held in memory
+    conn = op.get_bind()
+    last_id = 0
+
+    while True:
+        pastes = conn.execute(sa.select([
+            paste_table.c.id, paste_table.c.code
+        ]).where(sa.and_(
+            paste_table.c.id > last_id,
+            sa.func.length(paste_table.c.code) >= COMPRESS_THRESHOLD
+        )).order_by(paste_table.c.id).limit(BATCH_SIZE)).fetchall()
+
+        if not pastes:
+            break
+
+        for paste in pastes:
+            data = paste.code.encode('utf-8')
+            if len(data) < COMPRESS_THRESHOLD:
+                continue
+
+            conn.execute(paste_table.update().where(
+                paste_table.c.id == paste.id
+            ).values(
+                code=None,
+                compressed_code=zlib.compress(data)
+            ))
+
+        last_id = pastes[-1].id
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    # Decompress the compressed pastes, a page at a time
+    conn = op.get_bind()
+    last_id = 0
+
+    while True:
+        pastes = conn.execute(sa.select([
+            paste_table.c.id, paste_table.c.compressed_code
+        ]).where(sa.and_(
+            paste_table.c.id > last_id,
+            paste_table.c.compressed_code.isnot(None)
+        )).order_by(paste_table.c.id).limit(BATCH_SIZE)).fetchall()
+
+        if not pastes:
+            break
+
+        for paste in pastes:
+            conn.execute(paste_table.update().where(
+                paste_table.c.id == paste.id
+            ).values(
+                code=zlib.decompress(paste.compressed_code).decode('utf-8'),
+                compressed_code=None
+            ))
+
+        last_id = pastes[-1].id
+
+    with op.batch_alter_table('paste', schema=None) as batch_op:
+        batch_op.alter_column('code', existing_type=sa.Text(),
+                              nullable=False)
+        batch_op.drop_column('compressed_code')
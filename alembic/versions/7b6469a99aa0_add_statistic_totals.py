@@ -0,0 +1,46 @@
+"""Add statistic totals.
+
+Revision ID: 7b6469a99aa0
+Revises: ea4e40554c04
+Create Date: 2026-10-18 10:52:09.705617
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b6469a99aa0'
+down_revision = 'ea4e40554c04'
+branch_labels = None
+depends_on = None
+
+
+# The tables that are counted for each statistic
+STAT_TABLES = {
+    'shortened_links': 'url',
+    'uploaded_files': 'upload',
+    'pasted_code': 'paste',
+    'total': 'shortlink'
+}
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    stat_table = op.create_table(
+        'stat',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name', name=op.f('pk_stat'))
+    )
+
+    # Start the running totals from the current counts
+    for name, table in STAT_TABLES.items():
+        op.execute(stat_table.insert().from_select(
+            ['name', 'value'],
+            sa.select([sa.literal(name), sa.func.count()]).select_from(
+                sa.table(table))))
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    op.drop_table('stat')
@@ -0,0 +1,74 @@
+"""Add URL hash.
+
+Revision ID: 9e4b1f0c2d67
+Revises: 5d2e8b4c7a13
+Create Date: 2026-10-18 11:09:27.604518
+"""
+from alembic import op
+import sqlalchemy as sa
+import hashlib
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1f0c2d67'
+down_revision = '5d2e8b4c7a13'
+branch_labels = None
+depends_on = None
+
+
+# The number of URLs to read at a time
+BATCH_SIZE = 500
+
+url_table = sa.Table(
+    'url',
+    sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('url', sa.String(2048), nullable=False),
+    sa.Column('hash', sa.String(64), nullable=True)
+)
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    with op.batch_alter_table('url', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hash', sa.String(64), nullable=True))
+
+    # Hash the existing URLs, which are already normalised. They are read a
+    # page at a time so that they aren't all held in memory
+    conn = op.get_bind()
+    last_id = 0
+
+    while True:
+        urls = conn.execute(sa.select([
+            url_table.c.id, url_table.c.url
+        ]).where(
+            url_table.c.id > last_id
+        ).order_by(url_table.c.id).limit(BATCH_SIZE)).fetchall()
+
+        if not urls:
+            break
+
+        for url in urls:
+            conn.execute(url_table.update().where(
+                url_table.c.id == url.id
+            ).values(
+                hash=hashlib.sha256(url.url.encode('utf8')).hexdigest()
+            ))
+
+        last_id = urls[-1].id
+
+    with op.batch_alter_table('url', schema=None) as batch_op:
+        batch_op.alter_column('hash', existing_type=sa.String(64),
+                              nullable=False)
+        batch_op.create_index('ix_url_hash', ['hash', 'short_link_id'],
+                              unique=False)
+        batch_op.drop_index('ix_url_url')
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    with op.batch_alter_table('url', schema=None) as batch_op:
+        batch_op.create_index('ix_url_url', ['url', 'short_link_id'],
+                              unique=False, mysql_length={'url': 255})
+        batch_op.drop_index('ix_url_hash')
+        batch_op.drop_column('hash')
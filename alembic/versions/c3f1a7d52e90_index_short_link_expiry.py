@@ -0,0 +1,27 @@
+"""Index short link expiry.
+
+Revision ID: c3f1a7d52e90
+Revises: 7b6469a99aa0
+Create Date: 2026-10-18 10:58:02.418307
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a7d52e90'
+down_revision = '7b6469a99aa0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_shortlink_expiry'), ['expiry'],
+                              unique=False)
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_shortlink_expiry'))
@@ -0,0 +1,36 @@
+"""Index user links by creation.
+
+Revision ID: ea4e40554c04
+Revises: 0b0d67280891
+Create Date: 2026-10-18 10:51:19.690245
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'ea4e40554c04'
+down_revision = '0b0d67280891'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """Upgrade the database from the previous version."""
+    # The new index is created first so that MySQL always has an index for
+    # the user_id foreign key
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.create_index('ix_shortlink_user_id_created',
+                              ['user_id', 'created'], unique=False)
+
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.drop_index('ix_shortlink_user_id')
+
+
+def downgrade():
+    """Downgrade the database to the previous version."""
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.create_index('ix_shortlink_user_id', ['user_id'],
+                              unique=False)
+
+    with op.batch_alter_table('shortlink', schema=None) as batch_op:
+        batch_op.drop_index('ix_shortlink_user_id_created')
@@ -1,11 +1,31 @@
 """Methods for helping with authentication."""
-from jose import jwt
+from jose import jwk, jwt
 from fastapi import HTTPException
-from typing import Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+import httpx
 import requests
 from logzero import logger
 import json
+import threading
+import time
 from config import settings
+from utils.cache import TTLCache
+
+# Public keys from the JWKS, keyed by their key ID
+jwks_keys: Dict[str, Any] = {}
+jwks_refreshed = 0.0
+jwks_lock = threading.Lock()
+
+# The claims and user ID of tokens that have already been verified, keyed by
+# token
+token_cache = TTLCache(settings.cache.token_size, settings.cache.token_ttl)
+
+# User profiles from the OAuth server, keyed by the user's sub value
+profile_cache = TTLCache(settings.cache.profile_size,
+                         settings.cache.profile_ttl)
+
+# A shared client so that connections to the OAuth server are kept alive
+http_client = httpx.AsyncClient(timeout=settings.auth.timeout)
 
 
 class AuthError(HTTPException):
@@ -36,39 +56,132 @@ def parse_header(header: Optional[str]) -> Optional[str]:
     return header.replace("Bearer ", "")
 
 
-def parse_token(token: str) -> Dict:
-    """Parse and validate a JWT bearer token.
+def load_jwks() -> Dict:
+    """Load the JSON Web Key Set from the configured URL or file.
+
+    Returns:
+        Dict: The JSON Web Key Set.
+    """
+    if settings.auth.jwks_url:
+        r = requests.get(settings.auth.jwks_url, timeout=settings.auth.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    with open(settings.auth.jwks_file, "r") as f:
+        return json.load(f)
+
+
+def construct_key(key: Dict) -> Any:
+    """Construct a public key from a JSON Web Key.
 
     Args:
-        token (str): The token the parse and validate.
+        key (Dict): The JSON Web Key.
 
     Returns:
-        Dict: The contents of the JWT token.
+        Any: The public key, ready to be used for verifying tokens.
     """
+    algorithm = key.get("alg", settings.auth.algorithms[0])
+    constructed = jwk.construct(key, algorithm)
+
+    # The parsed key can be reused by backends that expose it, otherwise the
+    # JWK is parsed again for each token
+    return getattr(constructed, "prepared_key", key)
+
+
+def refresh_jwks(wait: bool = False) -> bool:
+    """Reload the public keys from the JSON Web Key Set.
+
+    Only one refresh runs at a time and the current keys are kept if the
+    refresh fails.
+
+    Args:
+        wait (bool, optional): Wait for a refresh that is already running to
+            finish. Defaults to False.
+
+    Returns:
+        bool: Whether the keys were reloaded by this call.
+    """
+    global jwks_keys, jwks_refreshed
+
+    if not jwks_lock.acquire(blocking=False):
+        if wait:
+            with jwks_lock:
+                pass
+        return False
+
     try:
-        with open("jwks.json", "r") as f:
-            jwks = json.load(f)
+        keys = {key["kid"]: construct_key(key) for key in load_jwks()["keys"]}
+        jwks_keys = keys
     except Exception as err:
         logger.error("Error loading JWKS: %s", err)
+        return False
+    finally:
+        # Retries are limited from when the refresh finished, so requests
+        # during a slow refresh don't count it as a recent attempt
+        jwks_refreshed = time.monotonic()
+        jwks_lock.release()
+
+    logger.debug("Loaded {} keys from the JWKS".format(len(keys)))
+    return True
+
+
+def get_key(kid: str) -> Optional[Any]:
+    """Get a public key from the JSON Web Key Set.
+
+    If the key isn't known, the key set is refreshed in the background so
+    that it can be used by later requests.
+
+    Args:
+        kid (str): The ID of the key.
+
+    Raises:
+        HTTPException: If the key set could not be loaded.
+
+    Returns:
+        Optional[Any]: The public key.
+    """
+    # Without any keys no token can be verified, so load them straight away,
+    # or wait for the refresh that is already running (such as on startup)
+    if not jwks_keys:
+        refresh_jwks(wait=True)
+
+    if not jwks_keys:
         raise HTTPException(status_code=500)
 
+    can_retry = (jwks_refreshed == 0 or time.monotonic() - jwks_refreshed >=
+                 settings.auth.jwks_retry)
+
+    key = jwks_keys.get(kid)
+
+    if key is None and can_retry:
+        threading.Thread(target=refresh_jwks, daemon=True).start()
+
+    return key
+
+
+def parse_token(token: str) -> Dict:
+    """Parse and validate a JWT bearer token.
+
+    Args:
+        token (str): The token the parse and validate.
+
+    Returns:
+        Dict: The contents of the JWT token.
+    """
     try:
         unverified_header = jwt.get_unverified_header(token)
     except jwt.JWTError:
         raise AuthError()
 
-    rsa_key = None
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = key
-            break
+    rsa_key = get_key(unverified_header.get("kid"))
 
     if rsa_key is None:
         logger.warning("Auth Error: The token's RSA key was not found")
         raise AuthError
 
     try:
-        return jwt.decode(token, rsa_key, algorithms=settings.auth.algorithms,
+        return jwt.decode(token, [rsa_key],
+                          algorithms=settings.auth.algorithms,
                           audience=settings.auth.audience,
                           issuer=settings.auth.issuer)
     except Exception as ex:
@@ -76,24 +189,59 @@ def parse_token(token: str) -> Dict:
         raise AuthError
 
 
-def get_profile(token: str) -> Optional[Dict]:
+def get_cached_token(token: str) -> Optional[Tuple[Dict, int]]:
+    """Get a token that has already been verified.
+
+    Args:
+        token (str): The JWT bearer token.
+
+    Returns:
+        Optional[Tuple[Dict, int]]: The contents of the token and the ID of
+            its user, or None if the token hasn't been verified recently.
+    """
+    return token_cache.get(token)
+
+
+def cache_token(token: str, claims: Dict, user_id: int) -> None:
+    """Remember a verified token until it expires.
+
+    Args:
+        token (str): The JWT bearer token.
+        claims (Dict): The contents of the token.
+        user_id (int): The ID of the token's user.
+    """
+    ttl = None
+    if "exp" in claims:
+        ttl = claims["exp"] - time.time()
+
+    token_cache.set(token, (claims, user_id), ttl=ttl)
+
+
+async def get_profile(token: str, sub: str) -> Optional[Dict]:
     """Get a user's profile from the external OAuth server.
 
     Args:
         token (str): The user's token to get the profile of.
+        sub (str): The user's sub value, used to cache the profile.
 
     Returns:
         Optional[Dict]: The user's profile.
     """
+    profile = profile_cache.get(sub)
+
+    if profile is not None:
+        return profile
+
     try:
-        r = requests.get(settings.auth.user_info_endpoint, headers={
+        r = await http_client.get(settings.auth.user_info_endpoint, headers={
             "Authorization": f"Bearer {token}"
         })
         r.raise_for_status()
-    except requests.exceptions.HTTPError as err:
-        logger.error("Error getting auth keys: %s", err)
+    except httpx.HTTPError as err:
+        logger.error("Error getting user profile: %s", err)
         raise HTTPException(status_code=500)
 
     profile = r.json()
+    profile_cache.set(sub, profile)
 
     return profile
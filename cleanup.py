@@ -1,47 +1,337 @@
-"""Methods for cleaning up expired uploads.
+"""Methods for cleaning up expired uploads and short links.
 
 These should be run as a cronjob. For example, to run every 6 hours:
 
     0 */6 * * * /path/to/venv/python /quark-server/cleanup.py >/dev/null 2>&1
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from logzero import logger
 import models
+from config import settings
+from crud import increment_stats, reconcile_stats, redirect_cache
 from database import SessionLocal
+from sqlalchemy import and_, exists, or_
+from sqlalchemy.orm import Session
 import datetime
-from utils.uploads import get_path
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Set
+from utils.uploads import blob_lock, get_path, get_uploads_folder
+import fcntl
 import os
+import time
 
+LOCK_FILE = ".cleanup.lock"
 
-def run_cleanup() -> None:
-    """Perform a full cleanup."""
-    logger.info("Performing cleanup...")
 
-    db = SessionLocal()
-    results = db.query(models.Upload).filter(
-        models.Upload.filename.isnot(None)).join(models.ShortLink).filter(
-        models.ShortLink.expiry <= datetime.datetime.utcnow())
+@contextmanager
+def cleanup_lock() -> Iterator[Optional[IO[str]]]:
+    """Hold the cleanup lock, so that only one process cleans up at a time.
 
-    logger.info("Found {} expired uploads!".format(results.count()))
+    The lock is a file in the upload folder, so it is shared by every worker
+    that serves the same uploads. It also holds the time the last completed
+    cleanup started.
 
-    for result in results:
-        path = get_path(result.filename)
+    Yields:
+        Optional[IO[str]]: The locked file, or None if another process is
+            already cleaning up.
+    """
+    with open(os.path.join(get_uploads_folder(), LOCK_FILE), "a+") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield None
+            return
 
         try:
-            os.remove(path)
-        except FileNotFoundError:
-            logger.warning("The file '{}' doesn't exist for upload {}".format(
-                result.filename, result.id))
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_last_cleanup(lock: IO[str]) -> float:
+    """Get the time the last completed cleanup started.
+
+    Args:
+        lock (IO[str]): The locked cleanup lock file.
+
+    Returns:
+        float: The time as a Unix timestamp, or 0 if no cleanup has completed.
+    """
+    lock.seek(0)
+
+    try:
+        return float(lock.read())
+    except ValueError:
+        return 0
+
+
+def set_last_cleanup(lock: IO[str], started: float) -> None:
+    """Record the time a completed cleanup started.
+
+    Args:
+        lock (IO[str]): The locked cleanup lock file.
+        started (float): The time as a Unix timestamp.
+    """
+    lock.seek(0)
+    lock.truncate()
+    lock.write(str(started))
+    lock.flush()
+
+
+def get_used_files(db: Session, filenames: Iterable[str],
+                   now: datetime.datetime) -> Set[str]:
+    """Find which stored files are still used by an upload that hasn't expired.
+
+    Args:
+        db (Session): A database instance.
+        filenames (Iterable[str]): The names of the stored files to check.
+        now (datetime.datetime): The time to check expiry against.
+
+    Returns:
+        Set[str]: The names of the files that are still used.
+    """
+    results = db.query(models.Upload.filename).join(
+        models.ShortLink).filter(
+        models.Upload.filename.in_(filenames),
+        or_(models.ShortLink.expiry.is_(None),
+            models.ShortLink.expiry > now)).distinct()
+
+    return {filename for filename, in results}
+
+
+def remove_file(filename: str) -> None:
+    """Remove a stored file.
+
+    Args:
+        filename (str): The name of the stored file.
+    """
+    try:
+        os.remove(get_path(filename))
+    except FileNotFoundError:
+        # Identical uploads share a file, so it may have been removed while
+        # expiring an earlier batch
+        logger.debug("The file '{}' has already been removed".format(
+            filename))
+        return
+
+    logger.debug("Removed file '{}'!".format(filename))
+
+
+def remove_stale_parts(max_age: float) -> int:
+    """Remove received uploads that were left behind in the upload folder.
+
+    Uploads are received into temporary `.*.part` files, which are left
+    behind if the worker receiving them is killed.
+
+    Args:
+        max_age (float): Files last modified more than this many seconds ago
+            are removed.
+
+    Returns:
+        int: The number of files that were removed.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+
+    with os.scandir(get_uploads_folder()) as entries:
+        for entry in entries:
+            if not (entry.name.startswith(".") and entry.name.endswith(
+                    ".part") and entry.is_file()):
+                continue
+
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # The upload was saved or discarded in the meantime
+                continue
+
+            logger.debug("Removed stale file '{}'!".format(entry.name))
+            removed += 1
+
+    return removed
+
+
+def expire_uploads(db: Session, now: datetime.datetime,
+                   batch_size: int) -> int:
+    """Expire the next batch of expired uploads and remove their files.
+
+    Files are removed before the uploads are updated, so if the cleanup is
+    interrupted the uploads are still found by the next cleanup and nothing
+    is left behind on disk. The lock on the stored files is held throughout,
+    so no upload can start using a file while it is being removed.
+
+    Args:
+        db (Session): A database instance.
+        now (datetime.datetime): The time to check expiry against.
+        batch_size (int): The maximum number of uploads to expire.
+
+    Returns:
+        int: The number of uploads that were expired.
+    """
+    # The batch is only read once the lock is held, so that every upload
+    # committed before then is seen and no more are until it is released
+    with blob_lock(exclusive=True):
+        uploads: List[models.Upload] = db.query(models.Upload).join(
+            models.ShortLink).filter(
+            models.Upload.filename.isnot(None),
+            models.ShortLink.expiry <= now).order_by(
+            models.Upload.id).limit(batch_size).all()
+
+        if not uploads:
+            return 0
+
+        # Stored files are shared by identical uploads, so they are only
+        # removed once no live upload uses them
+        filenames = {upload.filename for upload in uploads}
+        unused = filenames - get_used_files(db, filenames, now)
+
+        with ThreadPoolExecutor(settings.cleanup.workers) as executor:
+            list(executor.map(remove_file, unused))
+
+        for upload in uploads:
+            upload.filename = None
+            logger.debug("Expired upload {}!".format(upload.id))
+
+        db.commit()
+        return len(uploads)
+
+
+def purge_short_links(db: Session, cutoff: datetime.datetime,
+                      batch_size: int) -> int:
+    """Delete the next batch of short links that expired before a cutoff.
+
+    The URL, paste or upload of each short link is deleted with it. Uploads
+    are only deleted once their file has been expired, so that stored files
+    are never left without an upload that refers to them. The lock on the
+    stored files is held throughout, so no upload can be renewed meanwhile.
+
+    Args:
+        db (Session): A database instance.
+        cutoff (datetime.datetime): Short links that expired before this time
+            are deleted.
+        batch_size (int): The maximum number of short links to delete.
+
+    Returns:
+        int: The number of short links that were deleted.
+    """
+    # Uploads are given a new file and expiry while holding the lock on the
+    # stored files, so it is held for the batch to stop an upload from being
+    # renewed after it was found. A new transaction is started once it is
+    # held, so that renewals made before then are seen.
+    with blob_lock(exclusive=True):
+        db.commit()
+
+        short_links = db.query(
+            models.ShortLink.id, models.ShortLink.link).filter(
+            models.ShortLink.expiry <= cutoff,
+            ~exists().where(and_(
+                models.Upload.short_link_id == models.ShortLink.id,
+                models.Upload.filename.isnot(None)))).order_by(
+            models.ShortLink.id).limit(batch_size).all()
+
+        if not short_links:
+            return 0
+
+        ids = [short_link_id for short_link_id, _ in short_links]
+        stats: Dict[str, Any] = {"shortened_links": models.Url,
+                                 "pasted_code": models.Paste,
+                                 "uploaded_files": models.Upload}
+
+        for name, model in stats.items():
+            deleted = db.query(model).filter(
+                model.short_link_id.in_(ids)).delete(
+                synchronize_session=False)
+            if deleted:
+                increment_stats(db, name, amount=-deleted)
+
+        deleted = db.query(models.ShortLink).filter(
+            models.ShortLink.id.in_(ids)).delete(synchronize_session=False)
+        increment_stats(db, "total", amount=-deleted)
+        db.commit()
+
+        for _, link in short_links:
+            redirect_cache.pop(link)
+
+        return deleted
+
+
+def run_cleanup(force: bool = False) -> None:
+    """Perform a full cleanup.
+
+    Expired uploads are handled in batches, with the progress saved after
+    each batch. Short links that expired more than `cleanup.purge_after` days
+    ago are then deleted, if `cleanup.purge` is enabled, and received uploads
+    left behind for more than `cleanup.part_max_age` seconds are removed.
+
+    If another process is already cleaning up, or completed a cleanup that
+    started less than `cleanup.interval` seconds ago, nothing is done.
+
+    Args:
+        force (bool, optional): Clean up even if a cleanup was completed
+            recently. Defaults to False.
+    """
+    with cleanup_lock() as lock:
+        if lock is None:
+            logger.info("Cleanup is already running elsewhere, skipping")
+            return
+
+        started = time.time()
+
+        if not force and started - get_last_cleanup(
+                lock) < settings.cleanup.interval:
+            logger.info("Cleanup was completed recently, skipping")
+            return
+
+        logger.info("Performing cleanup...")
+
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            total = 0
+
+            while True:
+                expired = expire_uploads(db, now, settings.cleanup.batch_size)
+                if not expired:
+                    break
+
+                total += expired
+                logger.debug("Saved a batch of {} expired uploads".format(
+                    expired))
+
+            logger.info("Expired {} uploads!".format(total))
+
+            if settings.cleanup.purge:
+                cutoff = now - datetime.timedelta(
+                    days=settings.cleanup.purge_after)
+                total = 0
+
+                while True:
+                    purged = purge_short_links(db, cutoff,
+                                               settings.cleanup.batch_size)
+                    if not purged:
+                        break
+
+                    total += purged
+                    logger.debug("Deleted a batch of {} short links".format(
+                        purged))
+
+                logger.info("Deleted {} expired short links!".format(total))
 
-        logger.debug("Removed upload {}!".format(result.id))
+            removed = remove_stale_parts(settings.cleanup.part_max_age)
+            logger.info("Removed {} stale received uploads!".format(removed))
 
-        result.filename = None
-        db.add(result)
+            # Correct any drift in the running totals of the statistics
+            logger.debug("Recounting statistics...")
+            reconcile_stats(db)
+        finally:
+            db.close()
 
-    logger.debug("Saving database changes...")
-    db.commit()
-    db.close()
+        set_last_cleanup(lock, started)
 
 
 if __name__ == "__main__":
-    run_cleanup()
+    run_cleanup(force=True)
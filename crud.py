@@ -1,47 +1,187 @@
 """Methods for performing actions with the database."""
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
 import models
 import schemas
 import hashlib
-import uuid
 from tempfile import SpooledTemporaryFile
-import os
 from utils.retention import calculate_retention
 from fastapi import HTTPException
-from utils.uploads import save_upload
+from utils.uploads import (UploadTooLargeError, blob_lock, discard_upload,
+                           get_blob_name, receive_upload, save_upload)
 from typing import IO, Optional, Union
-from url_normalize import url_normalize
-from utils.linkgenerate import generate_link
+from utils.urls import normalize_url
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from logzero import logger
+from utils.linkgenerate import generate_link, get_capacity
 import datetime
-from typing import Dict
+from typing import Dict, Iterator, List, Sequence, Set, Tuple, TypeVar
+from config import settings
+from utils.cache import TTLCache
+
+T = TypeVar("T")
+
+# The URL a short link redirects to (if it is a URL) and its expiry
+Redirect = Tuple[Optional[str], Optional[datetime.datetime]]
+
+# The statistics that are kept as running totals
+STAT_NAMES = ("shortened_links", "uploaded_files", "pasted_code", "total")
+
+# The most values that are put in a single IN clause
+IN_CHUNK_SIZE = 500
+
+# Resolved short links for the redirect route, keyed by link
+redirect_cache = TTLCache(settings.cache.redirect_size,
+                          settings.cache.redirect_ttl)
+
+# The fraction of the two word link space that is in use
+occupancy_cache = TTLCache(1, settings.links.occupancy_ttl)
 
 
 def create_short_link(db: Session, user: Optional[schemas.User] = None
                       ) -> models.ShortLink:
     """Create a new short link.
 
+    The link is reserved by inserting it straight away and trying another
+    link if it is already taken. Links are lengthened with the configured
+    extension once the two word link space fills up.
+
     Args:
         db (Session): A database instance.
         user (Optional[schemas.User], optional): The user that has created the
             short link. Defaults to None.
 
+    Raises:
+        HTTPException: If a free link could not be found.
+
     Returns:
         models.ShortLink: The created short link.
     """
-    link = None
+    extension = get_link_extension(db)
 
-    while True:
-        link = generate_link()
+    for _ in range(settings.links.max_attempts):
+        link = generate_link(extension=extension,
+                             digits=settings.links.extension_digits)
+        db_short_link = models.ShortLink(link=link)
+
+        try:
+            with db.begin_nested():
+                db_short_link.user = user
+                db.add(db_short_link)
+        except IntegrityError:
+            logger.debug("Short link '{}' is already taken".format(link))
+            continue
+
+        redirect_cache.pop(link)
+        return db_short_link
+
+    logger.error("Could not find a free short link after {} attempts".format(
+        settings.links.max_attempts))
+    raise HTTPException(status_code=503,
+                        detail="Could not create a short link")
+
+
+def create_short_links(db: Session, count: int,
+                       user: Optional[models.User] = None
+                       ) -> List[Tuple[int, str]]:
+    """Create many short links at once.
+
+    Links are generated in rounds. Each round checks which of the generated
+    links are taken with one query per chunk and inserts the rest in one
+    statement, retrying the links that are taken in the next round.
+
+    Args:
+        db (Session): A database instance.
+        count (int): The number of short links to create.
+        user (Optional[models.User], optional): The user that has created the
+            short links. Defaults to None.
 
-        conflict = db.query(models.ShortLink).filter(
-            models.ShortLink.link == link).first()
+    Raises:
+        HTTPException: If enough free links could not be found.
 
-        if conflict is None:
+    Returns:
+        List[Tuple[int, str]]: The ID and link of each created short link.
+    """
+    extension = get_link_extension(db)
+    user_id = user.id if user is not None else None
+    links: Set[str] = set()
+
+    for _ in range(settings.links.max_attempts):
+        candidates = {generate_link(extension=extension,
+                                    digits=settings.links.extension_digits)
+                      for _ in range(count - len(links))} - links
+
+        for chunk in chunks(list(candidates), IN_CHUNK_SIZE):
+            taken = db.query(models.ShortLink.link).filter(
+                models.ShortLink.link.in_(chunk))
+            candidates -= {link for link, in taken}
+
+        if candidates:
+            try:
+                with db.begin_nested():
+                    db.execute(models.ShortLink.__table__.insert(), [
+                        {"link": link, "user_id": user_id}
+                        for link in candidates])
+            except IntegrityError:
+                # Another request took one of the links since they were
+                # checked, so try the whole round again
+                logger.debug("Short links were taken while being created")
+                continue
+
+            links |= candidates
+
+        if len(links) == count:
             break
+    else:
+        logger.error("Could not find {} free short links after {} attempts"
+                     .format(count, settings.links.max_attempts))
+        raise HTTPException(status_code=503,
+                            detail="Could not create the short links")
 
-    db_short_link = models.ShortLink(link=link)
-    db_short_link.user = user
-    return db_short_link
+    short_links = []
+    for chunk in chunks(list(links), IN_CHUNK_SIZE):
+        short_links.extend(db.query(
+            models.ShortLink.id, models.ShortLink.link).filter(
+            models.ShortLink.link.in_(chunk)))
+
+    for _, link in short_links:
+        redirect_cache.pop(link)
+
+    return [(short_link_id, link) for short_link_id, link in short_links]
+
+
+def get_link_extension(db: Session) -> Optional[str]:
+    """Get the extension to lengthen new links with.
+
+    Args:
+        db (Session): A database instance.
+
+    Returns:
+        Optional[str]: The extension, or None if the two word link space is
+            not full enough to need one.
+    """
+    if get_link_occupancy(db) >= settings.links.extend_threshold:
+        return settings.links.extension
+
+    return None
+
+
+def get_link_occupancy(db: Session) -> float:
+    """Get the fraction of the two word link space that is in use.
+
+    Args:
+        db (Session): A database instance.
+
+    Returns:
+        float: The link space occupancy, between 0 and 1.
+    """
+    occupancy = occupancy_cache.get("occupancy")
+
+    if occupancy is None:
+        occupancy = get_stats(db)["link_occupancy"]
+
+    return occupancy
 
 
 def create_shorten(db: Session, url: schemas.Url,
@@ -57,27 +197,87 @@ def create_shorten(db: Session, url: schemas.Url,
     Returns:
         ShortLink: The created short link
     """
-    url.url = url_normalize(url.url)
+    url.url, url_hash = normalize_url(str(url.url))
 
     # Find conflicts that can be send instead
     conflict = db.query(models.Url).filter(
-            models.Url.url == url.url,
+            models.Url.hash == url_hash,
             models.Url.short_link.has(user=user)).first()
 
     if conflict is not None and conflict.short_link is not None:
         return conflict.short_link
 
-    db_url = models.Url(url=url.url)
+    db_url = models.Url(url=url.url, url_hash=url_hash)
     db_short_link = create_short_link(db=db, user=user)
     db_short_link.url = db_url
 
     db.add(db_url)
     db.add(db_short_link)
+    increment_stats(db, "shortened_links", "total")
     db.commit()
     db.refresh(db_short_link)
     return db_short_link
 
 
+def create_shorten_bulk(db: Session, urls: Sequence[str],
+                        user: Optional[models.User] = None
+                        ) -> List[models.ShortLink]:
+    """Create short URLs for many URLs at once.
+
+    URLs that have already been shortened (by the same user) are found with
+    one query per chunk, and the rest are inserted in bulk and saved in a
+    single commit.
+
+    Args:
+        db (Session): A database instance.
+        urls (Sequence[str]): The URLs to shorten.
+        user (Optional[models.User], optional): The user that has created the
+            short URLs. Defaults to None.
+
+    Returns:
+        List[ShortLink]: The short link of each URL, in the same order as the
+            URLs.
+    """
+    normalized = [normalize_url(str(url)) for url in urls]
+    hashes = list(dict.fromkeys(url_hash for _, url_hash in normalized))
+
+    # Find conflicts that can be send instead
+    short_link_ids: Dict[str, int] = {}
+    for chunk in chunks(hashes, IN_CHUNK_SIZE):
+        for url_hash, short_link_id in db.query(
+                models.Url.hash, models.Url.short_link_id).filter(
+                models.Url.hash.in_(chunk),
+                models.Url.short_link.has(user=user)):
+            short_link_ids.setdefault(url_hash, short_link_id)
+
+    new_urls = {url_hash: url for url, url_hash in normalized
+                if url_hash not in short_link_ids}
+
+    if new_urls:
+        short_links = create_short_links(db=db, count=len(new_urls),
+                                         user=user)
+        db.execute(models.Url.__table__.insert(), [
+            {"url": url, "hash": url_hash, "short_link_id": short_link_id}
+            for (url_hash, url), (short_link_id, _) in zip(new_urls.items(),
+                                                           short_links)])
+        short_link_ids.update(zip(new_urls, (
+            short_link_id for short_link_id, _ in short_links)))
+
+        increment_stats(db, "shortened_links", "total", amount=len(new_urls))
+        db.commit()
+
+    results: Dict[int, models.ShortLink] = {}
+    for chunk in chunks(list(set(short_link_ids.values())), IN_CHUNK_SIZE):
+        results.update((short_link.id, short_link) for short_link in db.query(
+            models.ShortLink).options(
+            joinedload(models.ShortLink.url),
+            joinedload(models.ShortLink.paste),
+            joinedload(models.ShortLink.upload)).filter(
+            models.ShortLink.id.in_(chunk)))
+
+    return [results[short_link_ids[url_hash]] for _, url_hash in normalized]
+
+
 def create_paste(db: Session, paste: schemas.PasteCreate,
                  user: Optional[schemas.User] = None) -> models.ShortLink:
     """Create a new paste.
@@ -108,6 +308,7 @@ def create_paste(db: Session, paste: schemas.PasteCreate,
 
     db.add(db_paste)
     db.add(db_short_link)
+    increment_stats(db, "pasted_code", "total")
     db.commit()
     db.refresh(db_short_link)
     return db_short_link
@@ -132,67 +333,175 @@ def create_upload(db: Session, filename: str,
     Returns:
         ShortLink: The created short link.
     """
-    new_filename = str(uuid.uuid4())
-    file_hash = hashlib.sha256(file.read()).hexdigest()
+    try:
+        temp_path, file_hash, file_size = receive_upload(
+            file, max_size=int(settings.uploads.max_size * 1e+6))
+    except UploadTooLargeError:
+        raise HTTPException(status_code=413,
+                            detail="Uploaded file is too large")
 
-    # Reset the file back to the beginning
-    file.seek(0)
+    # Identical files are stored once and shared by every upload of them
+    blob_name = get_blob_name(file_hash)
+
+    try:
+        retention = calculate_retention(file_size / 1e+6)
+
+        if retention < 0:
+            raise HTTPException(status_code=413,
+                                detail="Uploaded file is too large")
+
+        # Hold the lock until the upload is committed, so that the cleanup
+        # doesn't remove the stored file before it sees the upload using it
+        with blob_lock():
+            # Start a new transaction, so that the changes made by a cleanup
+            # that was waited for are seen on databases with repeatable reads
+            db.commit()
+
+            # Find conflicts that can be send instead
+            conflict = db.query(models.Upload).filter(
+                    models.Upload.hash == file_hash,
+                    models.Upload.short_link.has(user=user)).first()
+
+            if conflict is not None and conflict.short_link is not None:
+                # Resave file and reset retention if properly expired
+                if conflict.filename is None:
+                    save_upload(temp_path, blob_name)
+                    conflict.filename = blob_name
+
+                if conflict.short_link.expiry <= datetime.datetime.utcnow():
+                    conflict.short_link.set_expiry_days(retention)
+
+                db.add(conflict)
+                db.add(conflict.short_link)
+                db.commit()
+                db.refresh(conflict)
+                redirect_cache.pop(conflict.short_link.link)
+
+                return conflict.short_link
+
+            db_upload = models.Upload(original_filename=filename,
+                                      mimetype=mimetype, filename=blob_name,
+                                      file_hash=file_hash)
+            db_short_link = create_short_link(db=db, user=user)
+            db_short_link.upload = db_upload
+            db_short_link.set_expiry_days(retention)
+
+            save_upload(temp_path, blob_name)
+
+            db.add(db_upload)
+            db.add(db_short_link)
+            increment_stats(db, "uploaded_files", "total")
+            db.commit()
+            db.refresh(db_short_link)
+            return db_short_link
+    finally:
+        # Remove the received file if it wasn't needed
+        discard_upload(temp_path)
+
+
+async def get_short_link(db: AsyncSession, link: str
+                         ) -> Optional[models.ShortLink]:
+    """Get a short link by it's ID.
 
-    file_size = os.fstat(file.fileno()).st_size / 1e+6
-    retention = calculate_retention(file_size)
+    The URL, paste or upload of the short link is loaded in the same query.
 
-    if retention < 0:
-        raise HTTPException(status_code=413,
-                            detail="Uploaded file is too large")
+    Args:
+        db (AsyncSession): An asyncio database instance.
+        link (str): The link of the short link to find.
 
-    # Find conflicts that can be send instead
-    conflict = db.query(models.Upload).filter(
-            models.Upload.hash == file_hash,
-            models.Upload.short_link.has(user=user)).first()
+    Returns:
+        Optional[ShortLink]: The short link.
+    """
+    result = await db.execute(select(models.ShortLink).options(
+        joinedload(models.ShortLink.url),
+        joinedload(models.ShortLink.paste).undefer_group("code"),
+        joinedload(models.ShortLink.upload)).where(
+        models.ShortLink.link == link))
 
-    if conflict is not None and conflict.short_link is not None:
-        # Resave file and reset retention if properly expired
-        if conflict.filename is None:
-            save_upload(file, new_filename)
-            conflict.filename = new_filename
+    return result.scalars().first()
 
-        if conflict.short_link.expiry <= datetime.datetime.utcnow():
-            conflict.short_link.set_expiry_days(retention)
 
-        db.add(conflict)
-        db.add(conflict.short_link)
-        db.commit()
-        db.refresh(conflict)
+async def get_short_links(db: AsyncSession, links: Sequence[str]
+                          ) -> Dict[str, models.ShortLink]:
+    """Get many short links by their IDs.
 
-        return conflict.short_link
+    The short links are found with one query per chunk, with their URL,
+    paste or upload loaded in the same query. Paste code is not loaded.
 
-    db_upload = models.Upload(original_filename=filename, mimetype=mimetype,
-                              filename=new_filename, file_hash=file_hash)
-    db_short_link = create_short_link(db=db, user=user)
-    db_short_link.upload = db_upload
-    db_short_link.set_expiry_days(retention)
+    Args:
+        db (AsyncSession): An asyncio database instance.
+        links (Sequence[str]): The links of the short links to find.
 
-    save_upload(file, new_filename)
+    Returns:
+        Dict[str, ShortLink]: The short links that exist, keyed by link.
+    """
+    short_links: Dict[str, models.ShortLink] = {}
 
-    db.add(db_upload)
-    db.add(db_short_link)
-    db.commit()
-    db.refresh(db_short_link)
-    return db_short_link
+    for chunk in chunks(list(set(links)), IN_CHUNK_SIZE):
+        result = await db.execute(select(models.ShortLink).options(
+            joinedload(models.ShortLink.url),
+            joinedload(models.ShortLink.paste),
+            joinedload(models.ShortLink.upload)).where(
+            models.ShortLink.link.in_(chunk)))
+        short_links.update((short_link.link, short_link)
+                           for short_link in result.scalars())
 
+    return short_links
 
-def get_short_link(db: Session, link: str) -> models.ShortLink:
-    """Get a short link by it's ID.
+
+async def get_short_link_redirect(db: AsyncSession, link: str
+                                  ) -> Optional[Redirect]:
+    """Get only the columns needed to redirect a short link.
 
     Args:
-        db (Session): A database instance.
+        db (AsyncSession): An asyncio database instance.
+        link (str): The link of the short link to find.
+
+    Returns:
+        Optional[Redirect]: The URL that was shortened (or None if the short
+            link is not a URL) and the expiry of the short link, or None if
+            the short link doesn't exist.
+    """
+    result = await db.execute(
+        select(models.Url.url, models.ShortLink.expiry).select_from(
+            models.ShortLink).outerjoin(models.ShortLink.url).where(
+            models.ShortLink.link == link))
+    row = result.first()
+
+    if row is None:
+        return None
+
+    return (row.url, row.expiry)
+
+
+async def get_redirect(db: AsyncSession, link: str) -> Optional[Redirect]:
+    """Get where a short link redirects to, using the redirect cache.
+
+    Args:
+        db (AsyncSession): An asyncio database instance.
         link (str): The link of the short link to find.
 
     Returns:
-        ShortLink: The short link.
+        Optional[Redirect]: The URL that was shortened (or None if the short
+            link is not a URL) and the expiry of the short link, or None if
+            the short link doesn't exist.
     """
-    return db.query(models.ShortLink).filter(
-        models.ShortLink.link == link).first()
+    cached = redirect_cache.get(link)
+    if cached is not None:
+        return cached
+
+    result = await get_short_link_redirect(db=db, link=link)
+    if result is None:
+        return None
+
+    # Only live short links are cached, and never for longer than they live
+    ttl = None
+    expiry = result[1]
+    if expiry is not None:
+        ttl = (expiry - datetime.datetime.utcnow()).total_seconds()
+    redirect_cache.set(link, result, ttl=ttl)
+
+    return result
 
 
 def get_or_create_user(db: Session, sub: str) -> models.User:
@@ -217,6 +526,24 @@ def get_or_create_user(db: Session, sub: str) -> models.User:
     return db_user
 
 
+def get_user_reference(db: Session, user_id: int, sub: str) -> models.User:
+    """Get a user that is known to exist without querying the database.
+
+    Args:
+        db (Session): A database instance.
+        user_id (int): The ID of the user.
+        sub (str): The user's sub value.
+
+    Returns:
+        models.User: The user.
+    """
+    db_user = models.User(sub)
+    db_user.id = user_id
+    make_transient_to_detached(db_user)
+    db.add(db_user)
+    return db_user
+
+
 def get_user(db: Session, user_id: int) -> models.User:
     """Get a user by it's ID.
 
@@ -230,22 +557,101 @@ def get_user(db: Session, user_id: int) -> models.User:
     return db.query(models.User).filter(models.User.id == user_id).first()
 
 
-def get_user_links(db: Session, user_id: int) -> models.ShortLink:
-    """Get a given user's short links.
+def get_user_links(db: Session, user_id: int, limit: int,
+                   before: Optional[int] = None) -> List[models.ShortLink]:
+    """Get a page of a given user's short links, newest first.
+
+    Pages are found by the position of the last short link on the previous
+    page, so that each page is a range read of the user's short links. Paste
+    code is not loaded.
 
     Args:
         db (Session): A database instance.
         user_id (int): The ID of the user.
+        limit (int): The maximum number of short links to get.
+        before (Optional[int], optional): The ID of the short link to get the
+            links created before, which may have been deleted. Defaults to
+            None.
 
     Returns:
         List[ShortLinks]: The user's short links.
     """
-    return db.query(models.ShortLink).filter(
-        models.ShortLink.user_id == user_id).order_by(
-        models.ShortLink.created.desc()).all()
+    query = db.query(models.ShortLink).options(
+        joinedload(models.ShortLink.url),
+        joinedload(models.ShortLink.paste),
+        joinedload(models.ShortLink.upload)).filter(
+        models.ShortLink.user_id == user_id)
+
+    if before is not None:
+        # Compare against the stored value rather than a parameter, as some
+        # databases store the creation time in a different format
+        before_created = db.query(models.ShortLink.created).filter(
+            models.ShortLink.id == before).scalar_subquery()
+        # If the short link has since been deleted, the links before it are
+        # found by ID instead, as IDs are given out in order of creation
+        query = query.filter(or_(
+            models.ShortLink.created < before_created,
+            and_(models.ShortLink.created == before_created,
+                 models.ShortLink.id < before),
+            and_(before_created.is_(None), models.ShortLink.id < before)))
+
+    return query.order_by(models.ShortLink.created.desc(),
+                          models.ShortLink.id.desc()).limit(limit).all()
+
+
+def chunks(items: Sequence[T], size: int) -> Iterator[Sequence[T]]:
+    """Split a sequence into chunks.
+
+    Args:
+        items (Sequence[T]): The items to split.
+        size (int): The largest number of items in a chunk.
+
+    Yields:
+        Sequence[T]: Each chunk of items.
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def increment_stats(db: Session, *names: str, amount: int = 1) -> None:
+    """Add to the running totals of statistics.
+
+    The change is made as part of the current transaction.
+
+    Args:
+        db (Session): A database instance.
+        *names (str): The names of the statistics.
+        amount (int, optional): The amount to add. Defaults to 1.
+    """
+    db.query(models.Stat).filter(models.Stat.name.in_(names)).update(
+        {models.Stat.value: models.Stat.value + amount},
+        synchronize_session=False)
+
+
+def reconcile_stats(db: Session) -> Dict[str, int]:
+    """Recount the statistics and save them as the running totals.
+
+    Args:
+        db (Session): A database instance.
+
+    Returns:
+        Dict[str, int]: The recounted statistics.
+    """
+    stats = {
+        "shortened_links": db.query(models.Url).count(),
+        "uploaded_files": db.query(models.Upload).count(),
+        "pasted_code": db.query(models.Paste).count(),
+        "total": db.query(models.ShortLink).count()
+    }
+
+    for name, value in stats.items():
+        db.merge(models.Stat(name, value))
+    db.commit()
 
+    return stats
 
-def get_stats(db: Session) -> Dict[str, int]:
+
+def get_stats(db: Session) -> Dict[str, Union[int, float]]:
     """Get the current statistics.
 
     Args:
@@ -254,14 +660,27 @@ def get_stats(db: Session) -> Dict[str, int]:
     Returns:
         dict: The instance's statistics.
     """
-    shortens = db.query(models.Url).count()
-    uploads = db.query(models.Upload).count()
-    pastes = db.query(models.Paste).count()
-    total = db.query(models.ShortLink).count()
-
-    return {
-        "shortened_links": shortens,
-        "uploaded_files": uploads,
-        "pasted_code": pastes,
-        "total": total
-    }
+    stats: Dict[str, Union[int, float]] = {
+        stat.name: stat.value for stat in db.query(models.Stat)}
+
+    if any(name not in stats for name in STAT_NAMES):
+        stats.update(reconcile_stats(db))
+
+    capacity = get_capacity()
+    occupancy_cache.set("occupancy", stats["total"] / capacity)
+
+    stats["link_capacity"] = capacity
+    stats["link_occupancy"] = stats["total"] / capacity
+    return stats
+
+
+async def get_stats_async(db: AsyncSession) -> Dict[str, Union[int, float]]:
+    """Get the current statistics with an asyncio database instance.
+
+    Args:
+        db (AsyncSession): An asyncio database instance.
+
+    Returns:
+        dict: The instance's statistics.
+    """
+    return await db.run_sync(get_stats)
@@ -1,12 +1,28 @@
 """SQLAlchemy objects."""
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.engine import Connection, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from config import settings
 
+# The asyncio drivers used for each database
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+asyncmy"
+}
+
 SQLALCHEMY_DATABASE_URL = settings.database
 SQLALCHEMY_POOL_RECYCLE = 3600
 SQLALCHEMY_ARGUMENTS = {}
+SQLALCHEMY_BACKEND = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name()
+
+# The read routes use an asyncio session, so only databases with an asyncio
+# driver are supported
+if SQLALCHEMY_BACKEND not in ASYNC_DRIVERS:
+    raise ValueError(
+        "Unsupported database backend '{}', expected one of: {}".format(
+            SQLALCHEMY_BACKEND, ", ".join(ASYNC_DRIVERS)))
 
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite:"):
     SQLALCHEMY_ARGUMENTS["check_same_thread"] = False
@@ -17,6 +33,27 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL,
                        pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "savepoint")
+    def sqlite_savepoint(connection: Connection, name: str) -> None:
+        """Start a transaction for a savepoint if one hasn't been started.
+
+        pysqlite only starts a transaction before the first write, and a
+        savepoint made outside of a transaction is committed when released.
+        """
+        if not connection.connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
+
+SQLALCHEMY_ASYNC_DATABASE_URL = make_url(SQLALCHEMY_DATABASE_URL).set(
+    drivername=ASYNC_DRIVERS[SQLALCHEMY_BACKEND])
+
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL,
+                                   pool_recycle=SQLALCHEMY_POOL_RECYCLE,
+                                   pool_pre_ping=True)
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False,
+                                 expire_on_commit=False, bind=async_engine,
+                                 class_=AsyncSession)
+
 metadata = MetaData(naming_convention={
     "ix": "ix_%(column_0_label)s",
     "uq": "uq_%(table_name)s_%(column_0_name)s",
@@ -1,19 +1,19 @@
 """Main Quark API."""
 from fastapi import Header
 from cleanup import run_cleanup
-from utils.uploads import get_path
-from fastapi import FastAPI, Depends, File, UploadFile
+from fastapi import FastAPI, Depends, File, Query, Request, UploadFile
 from fastapi.exceptions import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from starlette.responses import FileResponse, RedirectResponse, Response
+from starlette.responses import RedirectResponse, Response
 import uvicorn
 from fastapi_utils.tasks import repeat_every
 import crud
 from crud import get_or_create_user
 import schemas
-from database import SessionLocal
+from database import AsyncSessionLocal, SessionLocal, async_engine
 from datetime import datetime
-from typing import Any, Dict, Optional, List
+from typing import Any, AsyncIterator, Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from os import getenv
 from urllib.parse import urljoin
@@ -21,6 +21,11 @@ from logzero import logger
 import utils.languages
 import models
 import auth
+from middleware import CompressionMiddleware, UploadSizeLimitMiddleware
+from responses import UploadResponse
+from utils.http import (choose_encoding, get_cache_control, get_cache_headers,
+                        get_max_age, is_not_modified)
+from config import settings
 
 VERSION = "1.2.0"
 
@@ -39,8 +44,13 @@ app = FastAPI(title="Quark",
                                       "integration with the web app.")
                   }
               ])
+app.add_middleware(UploadSizeLimitMiddleware, path="/upload")
+app.add_middleware(CompressionMiddleware,
+                   minimum_size=settings.compression.minimum_size,
+                   exclude=("/dl/",))
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
-                   allow_methods=["*"], allow_headers=["*"])
+                   allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["X-Next-Cursor"])
 
 
 def get_db() -> Session:
@@ -56,6 +66,16 @@ def get_db() -> Session:
         db.close()
 
 
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """Fetch an asyncio database instance.
+
+    Yields:
+        AsyncSession: An asyncio database instance
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def get_current_user(authorization: Optional[str] = Header(None),
                      db: Session = Depends(get_db)) -> Optional[models.User]:
     """Get the current user.
@@ -77,9 +97,17 @@ def get_current_user(authorization: Optional[str] = Header(None),
     if token is None:
         return None
 
+    cached = auth.get_cached_token(token)
+
+    if cached is not None:
+        token_data, user_id = cached
+        return crud.get_user_reference(db=db, user_id=user_id,
+                                       sub=token_data["sub"])
+
     token_data = auth.parse_token(token)
 
     user = get_or_create_user(db=db, sub=token_data["sub"])
+    auth.cache_token(token, token_data, user.id)
     return user
 
 
@@ -102,7 +130,7 @@ def get_required_user(user: schemas.User = Depends(get_current_user)
 
 
 @app.get("/", tags=["routing"])
-def web_app() -> Response:
+async def web_app() -> Response:
     """Redirect to the web app."""
     return RedirectResponse(getenv("INSTANCE_APP_URL", "https://app.vh7.uk"),
                             status_code=308)
@@ -116,6 +144,18 @@ def create_shorten(url: schemas.Url, db: Session = Depends(get_db),
     return crud.create_shorten(db=db, url=url, user=user)
 
 
+@app.post("/shorten/bulk", response_model=List[schemas.ShortLink])
+def create_shorten_bulk(urls: schemas.UrlBulk, db: Session = Depends(get_db),
+                        user: Optional[models.User] =
+                        Depends(get_current_user)
+                        ) -> List[models.ShortLink]:
+    """Shorten many URLs into short links at once.
+
+    The short links are in the same order as the URLs.
+    """
+    return crud.create_shorten_bulk(db=db, urls=urls.urls, user=user)
+
+
 @app.post("/paste", response_model=schemas.ShortLink)
 def create_paste(paste: schemas.PasteCreate, db: Session = Depends(get_db),
                  user: Optional[schemas.User] =
@@ -134,9 +174,11 @@ def create_upload(file: UploadFile = File(...), db: Session = Depends(get_db),
 
 
 @app.get("/info/{link}", response_model=schemas.ShortLink)
-def short_link_info(link: str, db: Session = Depends(get_db)) -> Response:
+async def short_link_info(link: str, request: Request, response: Response,
+                          db: AsyncSession = Depends(get_async_db)
+                          ) -> Response:
     """Get information on a given short link."""
-    short_link = crud.get_short_link(db=db, link=link)
+    short_link = await crud.get_short_link(db=db, link=link)
 
     if short_link is None:
         raise HTTPException(status_code=404,
@@ -147,13 +189,54 @@ def short_link_info(link: str, db: Session = Depends(get_db)) -> Response:
         raise HTTPException(status_code=404,
                             detail="The given short link has expired")
 
+    # Short links are only changed when their expiry is extended, which also
+    # changes when they were updated
+    etag = 'W/"{}-{}"'.format(short_link.id,
+                              short_link.updated.strftime("%Y%m%d%H%M%S%f"))
+    headers = get_cache_headers(
+        etag, short_link.updated,
+        get_max_age(short_link.expiry, settings.cache.info_max_age))
+
+    if is_not_modified(request.headers, etag, short_link.updated):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
     return short_link
 
 
+@app.post("/info/batch", response_model=List[schemas.ShortLinkResult])
+async def short_link_info_batch(batch: schemas.ShortLinkBatch,
+                                db: AsyncSession = Depends(get_async_db)
+                                ) -> List[Dict[str, Any]]:
+    """Get information on many short links at once.
+
+    Each link is reported as found, expired or missing, in the same order as
+    the links. The code of pastes is not included.
+    """
+    short_links = await crud.get_short_links(db=db, links=batch.links)
+    now = datetime.utcnow()
+
+    results = []
+    for link in batch.links:
+        short_link = short_links.get(link)
+
+        if short_link is None:
+            results.append({"link": link, "status": "missing"})
+        elif short_link.expiry is not None and short_link.expiry <= now:
+            results.append({"link": link, "status": "expired"})
+        else:
+            results.append({"link": link, "status": "found",
+                            "short_link": short_link})
+
+    return results
+
+
 @app.get("/dl/{link}")
-def short_link_download(link: str, db: Session = Depends(get_db)) -> Response:
+async def short_link_download(link: str,
+                              db: AsyncSession = Depends(get_async_db)
+                              ) -> Response:
     """Download the file from a given short link (only for uploads)."""
-    short_link = crud.get_short_link(db=db, link=link)
+    short_link = await crud.get_short_link(db=db, link=link)
 
     if short_link is None:
         raise HTTPException(status_code=404,
@@ -169,36 +252,53 @@ def short_link_download(link: str, db: Session = Depends(get_db)) -> Response:
         raise HTTPException(status_code=404,
                             detail="The given short link has expired")
 
-    return FileResponse(get_path(short_link.upload.filename),
-                        filename=short_link.upload.original_filename,
-                        media_type=short_link.upload.mimetype)
+    # The contents of a short link's file never change, but the short link
+    # can't be cached for longer than it exists
+    max_age = get_max_age(short_link.expiry, settings.cache.download_max_age)
+    return UploadResponse(short_link.upload, headers={
+        "cache-control": get_cache_control(max_age, immutable=True)})
 
 
 @app.get("/users/me", response_model=schemas.User, tags=["users"])
-def get_user(current_user: schemas.User = Depends(get_required_user),
-             authorization: Optional[str] = Header(None)) -> Optional[Dict]:
+async def get_user(current_user: models.User = Depends(get_required_user),
+                   authorization: Optional[str] = Header(None)
+                   ) -> Optional[Dict]:
     """Get the logged in user details."""
     token = auth.parse_header(authorization)
 
     if token is None:
         raise auth.AuthError
 
-    profile = auth.get_profile(token)
+    profile = await auth.get_profile(token, current_user.sub)
     return profile
 
 
-@app.get("/users/me/links", response_model=List[schemas.ShortLink],
+@app.get("/users/me/links", response_model=List[schemas.ShortLinkSummary],
          tags=["users"])
-def get_user_links(db: Session = Depends(get_db), current_user: models.User =
-                   Depends(get_required_user)) -> Response:
-    """Get a user's saved short links."""
-    return crud.get_user_links(db=db, user_id=current_user.id)
+def get_user_links(response: Response, limit: int = Query(50, ge=1, le=100),
+                   cursor: Optional[int] = None,
+                   db: Session = Depends(get_db), current_user: models.User =
+                   Depends(get_required_user)) -> List[models.ShortLink]:
+    """Get a page of a user's saved short links, newest first.
+
+    If there are more links, the `X-Next-Cursor` header of the response is
+    passed as the `cursor` to get the next page.
+    """
+    links = crud.get_user_links(db=db, user_id=current_user.id,
+                                limit=limit + 1, before=cursor)
+
+    if len(links) > limit:
+        links = links[:limit]
+        response.headers["X-Next-Cursor"] = str(links[-1].id)
+
+    return links
 
 
 @app.get("/info", response_model=schemas.InstanceInformation)
-def get_instance_information(db: Session = Depends(get_db)) -> Dict[str, Any]:
+async def get_instance_information(db: AsyncSession = Depends(get_async_db)
+                                   ) -> Dict[str, Any]:
     """Get the instance's information and statistics."""
-    stats = crud.get_stats(db)
+    stats = await crud.get_stats_async(db)
 
     return {
         "url": getenv("INSTANCE_URL", "https://unknown.vh7.uk"),
@@ -209,26 +309,46 @@ def get_instance_information(db: Session = Depends(get_db)) -> Dict[str, Any]:
 
 
 @app.get("/languages", tags=["misc"])
-def get_languages() -> Response:
+async def get_languages(request: Request) -> Response:
     """Get a list of the supported paste languages."""
-    return utils.languages.languages
+    encoding = choose_encoding(
+        request.headers.get("accept-encoding", ""),
+        (name for name in ("br", "gzip")
+         if name in utils.languages.rendered))
+    etag = utils.languages.etags[encoding]
+
+    headers = get_cache_headers(etag,
+                                max_age=settings.cache.languages_max_age)
+    headers["vary"] = "Accept-Encoding"
+
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding != "identity":
+        headers["content-encoding"] = encoding
+
+    return Response(utils.languages.rendered[encoding],
+                    media_type="application/json", headers=headers)
 
 
 @app.get("/{link}", tags=["routing"])
-def short_link_redirect(link: str, db: Session = Depends(get_db)) -> Response:
+async def short_link_redirect(link: str,
+                              db: AsyncSession = Depends(get_async_db)
+                              ) -> Response:
     """Route short links.
 
     URL type short links are redirected straight to the URL that was shortened.
     All other types are redirected to the web app for viewing.
     """
-    short_link = crud.get_short_link(db=db, link=link)
+    redirect = await crud.get_redirect(db=db, link=link)
 
-    if short_link is None:
+    if redirect is None:
         raise HTTPException(status_code=404,
                             detail="Short link not found")
 
-    if (short_link.expiry is not None and
-            short_link.expiry <= datetime.utcnow()):
+    target, expiry = redirect
+
+    if expiry is not None and expiry <= datetime.utcnow():
         raise HTTPException(status_code=404,
                             detail="The given short link has expired")
 
@@ -238,8 +358,8 @@ def short_link_redirect(link: str, db: Session = Depends(get_db)) -> Response:
 
     # If the short link is a URL, redirect straight to that instead of the
     # web app
-    if short_link.url is not None:
-        url = short_link.url.url
+    if target is not None:
+        url = target
 
     return RedirectResponse(url, status_code=308)
 
@@ -251,11 +371,30 @@ def task_startup_message() -> None:
 
 
 @app.on_event("startup")
-@repeat_every(seconds=14400)
+@repeat_every(seconds=settings.cleanup.interval)
 def task_cleanup() -> None:
     """Perform a cleanup periodically."""
     run_cleanup()
 
 
+@app.on_event("shutdown")
+async def task_close_http_client() -> None:
+    """Close the connections to the OAuth server."""
+    await auth.http_client.aclose()
+
+
+@app.on_event("shutdown")
+async def task_close_database() -> None:
+    """Close the asyncio database connections."""
+    await async_engine.dispose()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=settings.auth.jwks_refresh)
+def task_refresh_jwks() -> None:
+    """Refresh the JSON Web Key Set periodically."""
+    auth.refresh_jwks()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
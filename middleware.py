@@ -0,0 +1,151 @@
+"""ASGI middleware."""
+from typing import Sequence
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+
+# Room for the multipart boundaries and headers around an uploaded file
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def get_max_body_size() -> int:
+    """Get the largest upload request body that will be accepted.
+
+    Returns:
+        int: The maximum size of the request body in bytes.
+    """
+    return int(settings.uploads.max_size * 1e+6) + MULTIPART_OVERHEAD
+
+
+class UploadSizeLimitMiddleware:
+    """Middleware that rejects oversized uploads while they are received.
+
+    Requests with a `Content-Length` that is too large are rejected before
+    any of the body is read. Otherwise the body is counted as it arrives and
+    the request is rejected as soon as it goes over the limit, instead of
+    after the whole file has been received.
+    """
+    def __init__(self, app: ASGIApp, path: str = "/upload") -> None:
+        """Create a new upload size limit middleware.
+
+        Args:
+            app (ASGIApp): The application to wrap.
+            path (str, optional): The path of the upload route. Defaults to
+                "/upload".
+        """
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        """Handle a request.
+
+        Args:
+            scope (Scope): The connection scope.
+            receive (Receive): The channel to receive messages on.
+            send (Send): The channel to send messages on.
+        """
+        if (scope["type"] != "http" or scope["method"] != "POST" or
+                scope["path"] != self.path):
+            await self.app(scope, receive, send)
+            return
+
+        limit = get_max_body_size()
+        response = JSONResponse({"detail": "Uploaded file is too large"},
+                                status_code=413)
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > limit:
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+
+            if rejected:
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+
+                if received > limit:
+                    # Respond straight away and tell the app that the client
+                    # has gone so that it stops reading the body
+                    rejected = True
+                    await response(scope, receive, send)
+                    return {"type": "http.disconnect"}
+
+            return message
+
+        async def limited_send(message: Message) -> None:
+            # The app's response is dropped once the request is rejected
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, limited_send)
+
+
+class EncodedAwareGZipResponder(GZipResponder):
+    """GZip responder that leaves responses that are already encoded alone."""
+    passthrough = False
+
+    async def send_with_gzip(self, message: Message) -> None:
+        """Send a message, compressing the response body if necessary.
+
+        Args:
+            message (Message): The message to send.
+        """
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = "content-encoding" in headers
+
+        if self.passthrough:
+            await self.send(message)
+        else:
+            await super().send_with_gzip(message)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Middleware that compresses responses for clients that accept GZip.
+
+    Responses that already have a `Content-Encoding` are sent as they are.
+    Paths can be excluded, such as downloads that are sent with byte ranges
+    and `sendfile`.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = 500,
+                 exclude: Sequence[str] = ()) -> None:
+        """Create a new compression middleware.
+
+        Args:
+            app (ASGIApp): The application to wrap.
+            minimum_size (int, optional): The smallest response body that is
+                compressed, in bytes. Defaults to 500.
+            exclude (Sequence[str], optional): The path prefixes that are
+                never compressed. Defaults to ().
+        """
+        super().__init__(app, minimum_size)
+        self.exclude = tuple(exclude)
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        """Handle a request.
+
+        Args:
+            scope (Scope): The connection scope.
+            receive (Receive): The channel to receive messages on.
+            send (Send): The channel to send messages on.
+        """
+        if (scope["type"] == "http" and
+                not scope["path"].startswith(self.exclude) and
+                "gzip" in Headers(scope=scope).get("accept-encoding", "")):
+            responder = EncodedAwareGZipResponder(self.app, self.minimum_size)
+            await responder(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
@@ -1,10 +1,13 @@
 """SQLAlchemy models."""
 from typing import Optional
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
-from sqlalchemy import Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, DateTime
+from sqlalchemy import LargeBinary, Text
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 import datetime
+import zlib
+
+from config import settings
 
 from database import Base
 
@@ -15,6 +18,9 @@ class ShortLink(Base):
     This is for storing the information for a specific short link.
     """
     __tablename__ = "shortlink"
+    __table_args__ = (
+        Index("ix_shortlink_user_id_created", "user_id", "created"),
+    )
 
     id = Column(Integer, primary_key=True)
     link = Column(String(100), unique=True, index=True)
@@ -22,7 +28,7 @@ class ShortLink(Base):
                      nullable=False)
     updated = Column(DateTime(timezone=True), server_default=func.now(),
                      onupdate=func.now(), nullable=False)
-    expiry = Column(DateTime(timezone=True), nullable=True)
+    expiry = Column(DateTime(timezone=True), nullable=True, index=True)
     url = relationship("Url", uselist=False,
                        back_populates="short_link")
     paste = relationship("Paste", uselist=False,
@@ -70,19 +76,25 @@ class Url(Base):
     This is for storing the information for a URL.
     """
     __tablename__ = "url"
+    __table_args__ = (
+        Index("ix_url_hash", "hash", "short_link_id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    short_link_id = Column(Integer, ForeignKey("shortlink.id"))
+    short_link_id = Column(Integer, ForeignKey("shortlink.id"), index=True)
     short_link = relationship("ShortLink", back_populates="url")
     url = Column(String(2048), nullable=False)
+    hash = Column(String(64), nullable=False)
 
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, url_hash: str) -> None:
         """Create a new URL object.
 
         Args:
-            url (str): The URL.
+            url (str): The normalised URL.
+            url_hash (str): A SHA256 hash of the `url`.
         """
         self.url = url
+        self.hash = url_hash
 
 
 class Paste(Base):
@@ -91,12 +103,19 @@ class Paste(Base):
     This is for storing the information for a single code paste.
     """
     __tablename__ = "paste"
+    __table_args__ = (
+        Index("ix_paste_hash", "hash", "short_link_id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    short_link_id = Column(Integer, ForeignKey("shortlink.id"))
+    short_link_id = Column(Integer, ForeignKey("shortlink.id"), index=True)
     short_link = relationship("ShortLink", back_populates="paste")
     language = Column(String(100), nullable=False)
-    code = Column(Text(), nullable=False)
+    # Large pastes are stored compressed. The code is only loaded when it is
+    # used, so that listing pastes doesn't read it
+    raw_code = deferred(Column("code", Text(), nullable=True), group="code")
+    compressed_code = deferred(Column(LargeBinary(), nullable=True),
+                               group="code")
     hash = Column(String(64), nullable=False)
 
     def __init__(self, code: str, language: str, code_hash: str) -> None:
@@ -112,6 +131,30 @@ class Paste(Base):
         self.language = language
         self.hash = code_hash
 
+    @property
+    def code(self) -> str:
+        """The chunk of text that is stored, decompressed if necessary."""
+        if self.compressed_code is not None:
+            return zlib.decompress(self.compressed_code).decode("utf-8")
+
+        return self.raw_code
+
+    @code.setter
+    def code(self, code: str) -> None:
+        """Store a chunk of text, compressing it if it is large.
+
+        Args:
+            code (str): The chunk of text to be stored.
+        """
+        data = code.encode("utf-8")
+
+        if len(data) >= settings.pastes.compress_threshold:
+            self.raw_code = None
+            self.compressed_code = zlib.compress(data)
+        else:
+            self.raw_code = code
+            self.compressed_code = None
+
 
 class Upload(Base):
     """SQLAlchemy model for uploads.
@@ -119,9 +162,14 @@ class Upload(Base):
     This is for storing the information for a single uploaded file.
     """
     __tablename__ = "upload"
+    __table_args__ = (
+        Index("ix_upload_hash", "hash", "short_link_id"),
+        Index("ix_upload_filename", "filename",
+              mysql_length={"filename": 255}),
+    )
 
     id = Column(Integer, primary_key=True)
-    short_link_id = Column(Integer, ForeignKey("shortlink.id"))
+    short_link_id = Column(Integer, ForeignKey("shortlink.id"), index=True)
     short_link = relationship("ShortLink", back_populates="upload")
     mimetype = Column(String(100), nullable=False)
     original_filename = Column(String(400), nullable=False)
@@ -167,3 +215,25 @@ class User(Base):
             sub (str): The user's external user ID.
         """
         self.sub = sub
+
+
+class Stat(Base):
+    """SQLAlchemy model for statistics.
+
+    This is for storing running totals so that they don't have to be counted
+    on every request.
+    """
+    __tablename__ = "stat"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False)
+
+    def __init__(self, name: str, value: int) -> None:
+        """Create a new statistic.
+
+        Args:
+            name (str): The name of the statistic.
+            value (int): The value of the statistic.
+        """
+        self.name = name
+        self.value = value
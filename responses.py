@@ -0,0 +1,153 @@
+"""Custom responses."""
+import os
+from typing import Dict, Optional
+import aiofiles
+from aiofiles.os import stat as aio_stat
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+import models
+from config import settings
+from utils.http import RangeNotSatisfiableError, etag_matches, parse_range
+from utils.uploads import get_path
+
+ZERO_COPY_SEND = "http.response.zerocopysend"
+# The headers that are kept in a 304 response
+NOT_MODIFIED_HEADERS = (b"cache-control", b"etag", b"expires", b"vary")
+
+
+class UploadResponse(FileResponse):
+    """Response for downloading an upload.
+
+    The stored hash of the upload is used as its ETag, so `If-None-Match`
+    requests get a 304 response. Single byte ranges are supported, so that
+    downloads can be resumed. The file is sent with `sendfile` if the server
+    supports it.
+
+    If `uploads.offload` is set, only the headers are sent and the front
+    proxy is told to send the file itself with `X-Accel-Redirect` (nginx) or
+    `X-Sendfile` (Apache, lighttpd).
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, upload: models.Upload,
+                 headers: Optional[Dict[str, str]] = None) -> None:
+        """Create a new upload response.
+
+        Args:
+            upload (models.Upload): The upload to send. It must have a stored
+                file.
+            headers (Optional[Dict[str, str]], optional): Extra headers for
+                the response, such as caching headers. Defaults to None.
+        """
+        self.etag = '"{}"'.format(upload.hash)
+        headers = {**(headers or {}), "etag": self.etag,
+                   "accept-ranges": "bytes"}
+
+        offload = settings.uploads.offload.lower()
+        if offload == "x-accel-redirect":
+            headers["x-accel-redirect"] = (settings.uploads.offload_prefix +
+                                           upload.filename.replace(os.sep,
+                                                                   "/"))
+        elif offload == "x-sendfile":
+            headers["x-sendfile"] = os.path.abspath(get_path(upload.filename))
+        self.offload = offload in ("x-accel-redirect", "x-sendfile")
+
+        super().__init__(get_path(upload.filename), headers=headers,
+                         media_type=upload.mimetype,
+                         filename=upload.original_filename)
+
+    async def send_headers(self, send: Send, status_code: int) -> None:
+        """Send the start of the response.
+
+        Args:
+            send (Send): The channel to send messages on.
+            status_code (int): The status code of the response.
+        """
+        await send({"type": "http.response.start", "status": status_code,
+                    "headers": self.raw_headers})
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        """Send the response.
+
+        Args:
+            scope (Scope): The connection scope.
+            receive (Receive): The channel to receive messages on.
+            send (Send): The channel to send messages on.
+        """
+        request_headers = Headers(scope=scope)
+
+        if etag_matches(request_headers.get("if-none-match", ""), self.etag):
+            self.raw_headers = [
+                (key, value) for key, value in self.raw_headers
+                if key in NOT_MODIFIED_HEADERS]
+            await self.send_headers(send, 304)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if self.offload:
+            # The proxy sends the file and handles ranges itself
+            await self.send_headers(send, self.status_code)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        try:
+            stat_result = await aio_stat(self.path)
+        except FileNotFoundError:
+            raise RuntimeError(
+                "File at path {} does not exist.".format(self.path))
+        self.set_stat_headers(stat_result)
+
+        size = stat_result.st_size
+        start, end = 0, size - 1
+        status_code = self.status_code
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header is not None and (
+                if_range is None or if_range.strip() in (
+                    self.etag, self.headers["last-modified"])):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiableError:
+                self.headers["content-range"] = "bytes */{}".format(size)
+                self.headers["content-length"] = "0"
+                await self.send_headers(send, 416)
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            if byte_range is not None:
+                start, end = byte_range
+                status_code = 206
+                self.headers["content-range"] = "bytes {}-{}/{}".format(
+                    start, end, size)
+                self.headers["content-length"] = str(end - start + 1)
+
+        await self.send_headers(send, status_code)
+
+        count = end - start + 1
+        if self.send_header_only or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+        elif ZERO_COPY_SEND in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({"type": ZERO_COPY_SEND, "file": file,
+                            "offset": start, "count": count})
+        else:
+            async with aiofiles.open(self.path, mode="rb") as file:
+                await file.seek(start)
+                while count > 0:
+                    chunk = await file.read(min(self.chunk_size, count))
+                    if not chunk:
+                        break
+
+                    count -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk,
+                                "more_body": count > 0})
+
+                if count > 0:
+                    # The file was shorter than expected, so end the response
+                    await send({"type": "http.response.body", "body": b""})
+
+        if self.background is not None:
+            await self.background()
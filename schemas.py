@@ -1,8 +1,9 @@
 """Pydantic schemas."""
-from typing import Optional
-from pydantic import BaseModel, HttpUrl, validator
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, HttpUrl, validator
 import datetime
 import utils.languages
+from config import settings
 
 
 class Url(BaseModel):
@@ -19,6 +20,20 @@ class Url(BaseModel):
         }
 
 
+class UrlBulk(BaseModel):
+    """Schema for shortening many URLs at once."""
+    urls: List[HttpUrl] = Field(..., min_items=1,
+                                max_items=settings.links.bulk_max)
+
+    class Config:
+        """Pydantic config section."""
+        schema_extra = {
+            "example": {
+                "urls": ["https://example.com", "https://example.org"]
+            }
+        }
+
+
 class PasteBase(BaseModel):
     """Schema for pasted code."""
     language: str
@@ -37,6 +52,8 @@ class PasteBase(BaseModel):
     def supported_language(cls, v: str) -> str:
         """Ensure the language of the paste is supported.
 
+        Aliases and file extensions are converted to the language's ID.
+
         Args:
             v (str): Value for the language field.
 
@@ -46,10 +63,10 @@ class PasteBase(BaseModel):
         Returns:
             str: The validated value.
         """
-        v = v.lower().strip()
-        if v not in utils.languages.language_ids:
+        language_id = utils.languages.get_language_id(v)
+        if language_id is None:
             raise ValueError("Language not supported")
-        return v
+        return language_id
 
 
 PasteCreate = PasteBase
@@ -72,6 +89,23 @@ class Paste(PasteBase):
         }
 
 
+class PasteSummary(BaseModel):
+    """Schema for pasted code, without the code."""
+    language: str
+    hash: str
+
+    class Config:
+        """Pydantic config section."""
+        orm_mode = True
+        schema_extra = {
+            "example": {
+                "language": "python",
+                "hash": ("50d858e0985ecc7f60418aaf0cc5ab587f42c2570a884095a9e8"
+                         "ccacd0f6545c")
+            }
+        }
+
+
 class UploadBase(BaseModel):
     """Schema for uploaded files."""
     mimetype: str
@@ -120,6 +154,42 @@ class ShortLink(BaseModel):
         orm_mode = True
 
 
+class ShortLinkSummary(BaseModel):
+    """Schema for short links, without the code of pastes."""
+    created: datetime.datetime
+    updated: datetime.datetime
+    url: Optional[Url]
+    paste: Optional[PasteSummary]
+    upload: Optional[Upload]
+    link: str
+    expiry: Optional[datetime.datetime]
+
+    class Config:
+        """Pydantic config section."""
+        orm_mode = True
+
+
+class ShortLinkBatch(BaseModel):
+    """Schema for looking up many short links at once."""
+    links: List[str] = Field(..., min_items=1,
+                             max_items=settings.links.batch_max)
+
+    class Config:
+        """Pydantic config section."""
+        schema_extra = {
+            "example": {
+                "links": ["wanted.horse", "anxious.cactus"]
+            }
+        }
+
+
+class ShortLinkResult(BaseModel):
+    """Schema for the result of looking up a short link in a batch."""
+    link: str
+    status: Literal["found", "expired", "missing"]
+    short_link: Optional[ShortLinkSummary]
+
+
 class Token(BaseModel):
     """Schema for authentication tokens."""
     access_token: str
@@ -137,6 +207,8 @@ class InstanceStats(BaseModel):
     uploaded_files: int
     pasted_code: int
     total: int
+    link_capacity: int
+    link_occupancy: float
 
     class Config:
         """Pydantic config section."""
@@ -145,7 +217,9 @@ class InstanceStats(BaseModel):
                 "shortened_links": 3,
                 "uploaded_files": 2,
                 "pasted_code": 1,
-                "total": 6
+                "total": 6,
+                "link_capacity": 2054175,
+                "link_occupancy": 0.0000029
             }
         }
 
@@ -168,7 +242,9 @@ class InstanceInformation(BaseModel):
                     "shortened_links": 3,
                     "uploaded_files": 2,
                     "pasted_code": 1,
-                    "total": 6
+                    "total": 6,
+                    "link_capacity": 2054175,
+                    "link_occupancy": 0.0000029
                 }
             }
         }
@@ -1,5 +1,17 @@
 """Tests for utility functions."""
+import brotli
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import pytest
+from config import settings
+from utils.cache import TTLCache
+from utils import languages, linkgenerate
 from utils.retention import calculate_retention
+from utils import http, uploads, urls
 
 
 class TestRetention:
@@ -18,3 +30,194 @@ class TestRetention:
         """Test retention time with a file that is too large."""
         assert calculate_retention(file_size=1000, min_age=30, max_age=90,
                                    max_size=256) == -1
+
+
+class TestTTLCache:
+    """Tests for the bounded in-process cache."""
+    def test_get_set(self):
+        """Test that cached values can be read back."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+    def test_evicts_least_recently_used(self):
+        """Test that the least recently used entry is evicted when full."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_expired_entry(self):
+        """Test that entries that have already expired are not cached."""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("a", 2, ttl=-1)
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+
+class TestLinkGenerate:
+    """Tests for short link generation."""
+    def test_generate_link(self):
+        """Test that a link is made from one word from each word list."""
+        parts = linkgenerate.generate_link().split(".")
+        assert len(parts) == len(linkgenerate.words)
+        for part, words in zip(parts, linkgenerate.words):
+            assert part in words
+
+    def test_generate_link_extension(self):
+        """Test that links can be lengthened with a word or a number."""
+        parts = linkgenerate.generate_link(extension="word").split(".")
+        assert len(parts) == len(linkgenerate.words) + 1
+        assert parts[0] in linkgenerate.words[0]
+
+        parts = linkgenerate.generate_link(extension="number",
+                                           digits=2).split(".")
+        assert len(parts) == len(linkgenerate.words) + 1
+        assert 0 <= int(parts[-1]) < 100
+
+    def test_capacity(self):
+        """Test the number of possible links."""
+        capacity = linkgenerate.get_capacity()
+        assert capacity == (len(linkgenerate.words[0]) *
+                            len(linkgenerate.words[1]))
+        assert linkgenerate.get_capacity("number", digits=2) == capacity * 100
+
+    def test_reload_word_lists(self):
+        """Test that the word lists are only reloaded when they change."""
+        assert not linkgenerate.reload_word_lists()
+        assert linkgenerate.reload_word_lists(force=True)
+
+
+class TestUploads:
+    """Tests for saving uploaded files."""
+    def test_receive_and_save(self, tmp_path, monkeypatch):
+        """Test that a received file is hashed and moved into place."""
+        monkeypatch.setattr(settings.uploads, "folder", str(tmp_path))
+        data = os.urandom(uploads.CHUNK_SIZE * 2 + 1)
+
+        temp_path, file_hash, size = uploads.receive_upload(io.BytesIO(data))
+        assert file_hash == hashlib.sha256(data).hexdigest()
+        assert size == len(data)
+
+        uploads.save_upload(temp_path, "saved")
+        assert os.listdir(tmp_path) == ["saved"]
+        with open(uploads.get_path("saved"), "rb") as f:
+            assert f.read() == data
+
+    def test_discard(self, tmp_path, monkeypatch):
+        """Test that a received file can be thrown away."""
+        monkeypatch.setattr(settings.uploads, "folder", str(tmp_path))
+
+        temp_path, _, _ = uploads.receive_upload(io.BytesIO(b"data"))
+        uploads.discard_upload(temp_path)
+        assert os.listdir(tmp_path) == []
+
+
+class TestHttp:
+    """Tests for the HTTP helper functions."""
+    def test_parse_range(self):
+        """Test parsing byte ranges."""
+        assert http.parse_range("bytes=0-99", 1000) == (0, 99)
+        assert http.parse_range("bytes=900-", 1000) == (900, 999)
+        assert http.parse_range("bytes=-100", 1000) == (900, 999)
+        assert http.parse_range("bytes=500-2000", 1000) == (500, 999)
+        assert http.parse_range("bytes=-2000", 1000) == (0, 999)
+
+    def test_parse_range_ignored(self):
+        """Test that malformed and multiple ranges are ignored."""
+        assert http.parse_range("bytes=0-9,20-29", 1000) is None
+        assert http.parse_range("items=0-9", 1000) is None
+        assert http.parse_range("bytes=9-0", 1000) is None
+        assert http.parse_range("bytes=-", 1000) is None
+        assert http.parse_range("bytes=a-9", 1000) is None
+
+    def test_parse_range_not_satisfiable(self):
+        """Test ranges that are outside of the file."""
+        for header, size in (("bytes=1000-", 1000), ("bytes=-0", 1000),
+                             ("bytes=0-9", 0)):
+            with pytest.raises(http.RangeNotSatisfiableError):
+                http.parse_range(header, size)
+
+    def test_etag_matches(self):
+        """Test matching ETags against conditional headers."""
+        assert http.etag_matches('"a"', '"a"')
+        assert http.etag_matches('"b", W/"a"', '"a"')
+        assert http.etag_matches("*", '"a"')
+        assert not http.etag_matches('"b"', '"a"')
+        assert not http.etag_matches("", '"a"')
+
+    def test_get_max_age(self):
+        """Test that responses aren't cached for longer than they exist."""
+        now = datetime.datetime.utcnow()
+        assert http.get_max_age(None, 3600) == 3600
+        assert 590 <= http.get_max_age(
+            now + datetime.timedelta(minutes=10), 3600) <= 600
+        assert http.get_max_age(now + datetime.timedelta(days=1), 3600) == 3600
+        assert http.get_max_age(now - datetime.timedelta(days=1), 3600) == 0
+
+    def test_is_not_modified(self):
+        """Test conditional request headers."""
+        modified = datetime.datetime(2021, 1, 1, 12, 0, 0, 500)
+        date = "Fri, 01 Jan 2021 12:00:00 GMT"
+        assert http.is_not_modified({"if-none-match": '"a"'}, '"a"')
+        assert http.is_not_modified({"if-modified-since": date}, '"a"',
+                                    modified)
+        assert not http.is_not_modified(
+            {"if-modified-since": "Thu, 31 Dec 2020 12:00:00 GMT"}, '"a"',
+            modified)
+        assert not http.is_not_modified(
+            {"if-none-match": '"b"', "if-modified-since": date}, '"a"',
+            modified)
+        assert not http.is_not_modified({"if-modified-since": "nonsense"},
+                                        '"a"', modified)
+        assert http.format_http_date(modified) == date
+
+    def test_choose_encoding(self):
+        """Test choosing a content encoding from `Accept-Encoding`."""
+        assert http.choose_encoding("gzip, deflate, br",
+                                    ("br", "gzip")) == "br"
+        assert http.choose_encoding("gzip", ("br", "gzip")) == "gzip"
+        assert http.choose_encoding("br;q=0, gzip;q=0.5",
+                                    ("br", "gzip")) == "gzip"
+        assert http.choose_encoding("*", ("br", "gzip")) == "br"
+        assert http.choose_encoding("", ("br", "gzip")) == "identity"
+
+
+class TestLanguages:
+    """Tests for the paste languages."""
+    def test_get_language_id(self):
+        """Test finding languages by ID, name, alias and file extension."""
+        assert languages.get_language_id("python") == "python"
+        assert languages.get_language_id(" Python ") == "python"
+        assert languages.get_language_id("py") == "python"
+        assert languages.get_language_id(".rs") == "rust"
+        assert languages.get_language_id("sas") == "SAS"
+        assert languages.get_language_id("nonsense") is None
+
+    def test_aliases(self):
+        """Test that every alias is for a supported language."""
+        assert set(languages.aliases.values()) <= languages.language_ids
+
+    def test_rendered_languages(self):
+        """Test that every encoding of the rendered list has the same body."""
+        body = languages.rendered["identity"]
+        assert json.loads(body) == languages.languages
+        assert gzip.decompress(languages.rendered["gzip"]) == body
+        assert brotli.decompress(languages.rendered["br"]) == body
+        assert len(set(languages.etags.values())) == len(languages.rendered)
+
+
+class TestUrls:
+    """Tests for the URL functions."""
+    def test_normalize_url(self):
+        """Test normalising and hashing URLs."""
+        url, url_hash = urls.normalize_url("HTTPS://Example.com:443")
+        assert url == "https://example.com/"
+        assert url_hash == hashlib.sha256(url.encode("utf8")).hexdigest()
+        assert urls.normalize_url("https://example.com/") == (url, url_hash)
@@ -0,0 +1,94 @@
+"""Bounded in-process caches."""
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """A thread-safe least recently used cache with expiring entries.
+
+    The least recently used entry is evicted once the cache holds `maxsize`
+    entries, and entries are discarded when they are read after their time to
+    live has passed.
+    """
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Create a new cache.
+
+        Args:
+            maxsize (int): The maximum number of entries to keep.
+            ttl (float): The default number of seconds to keep an entry for.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry from the cache.
+
+        Args:
+            key (Hashable): The key of the entry.
+            default (Any, optional): The value to return if there is no live
+                entry for the key. Defaults to None.
+
+        Returns:
+            Any: The cached value.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any,
+            ttl: Optional[float] = None) -> None:
+        """Add or replace an entry in the cache.
+
+        Args:
+            key (Hashable): The key of the entry.
+            value (Any): The value to cache.
+            ttl (Optional[float], optional): The number of seconds to keep the
+                entry for. This is capped to the cache's default time to live.
+                Defaults to None.
+        """
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            self.pop(key)
+            return
+
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Remove an entry from the cache if it exists.
+
+        Args:
+            key (Hashable): The key of the entry.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        """Get the number of entries in the cache, including expired ones.
+
+        Returns:
+            int: The number of entries.
+        """
+        return len(self._data)
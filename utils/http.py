@@ -0,0 +1,226 @@
+"""HTTP helper functions."""
+import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+
+class RangeNotSatisfiableError(Exception):
+    """Error for when a requested range is outside of the requested file."""
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a `Range` header for a single range of bytes.
+
+    Headers that are malformed or ask for several ranges are ignored, in
+    which case the whole file should be sent.
+
+    Args:
+        header (str): The value of the `Range` header.
+        size (int): The size of the requested file in bytes.
+
+    Raises:
+        RangeNotSatisfiableError: If the range doesn't overlap the file.
+
+    Returns:
+        Optional[Tuple[int, int]]: The first and last bytes of the range
+            (inclusive), or None if the header should be ignored.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    start, _, end = ranges.strip().partition("-")
+    if not (start or end) or not all(
+            part.isdigit() for part in (start, end) if part):
+        return None
+
+    if not start:
+        # A suffix range, for the last bytes of the file
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiableError()
+
+        return max(size - length, 0), size - 1
+
+    first = int(start)
+    if end and int(end) < first:
+        return None
+
+    if first >= size:
+        raise RangeNotSatisfiableError()
+
+    last = int(end) if end else size - 1
+    return first, min(last, size - 1)
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Check if an `If-None-Match` header matches an ETag.
+
+    Weak comparison is used, so weak and strong versions of an ETag match.
+
+    Args:
+        header (str): The value of the header.
+        etag (str): The ETag of the resource.
+
+    Returns:
+        bool: Whether the header matches the ETag.
+    """
+    def strip_weak(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    if header.strip() == "*":
+        return True
+
+    return strip_weak(etag) in (strip_weak(tag) for tag in header.split(","))
+
+
+def format_http_date(date: datetime.datetime) -> str:
+    """Format a date for use in an HTTP header.
+
+    Args:
+        date (datetime.datetime): The date. Dates without a timezone are
+            assumed to be in UTC.
+
+    Returns:
+        str: The formatted date.
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return format_datetime(date.astimezone(datetime.timezone.utc),
+                           usegmt=True)
+
+
+def get_max_age(expiry: Optional[datetime.datetime], max_age: int) -> int:
+    """Get how long a response can be cached for.
+
+    Args:
+        expiry (Optional[datetime.datetime]): When the resource expires, in
+            UTC, or None if it doesn't expire.
+        max_age (int): The longest that the response can be cached for, in
+            seconds.
+
+    Returns:
+        int: The number of seconds the response can be cached for.
+    """
+    if expiry is None:
+        return max_age
+
+    remaining = (expiry - datetime.datetime.utcnow()).total_seconds()
+    return max(0, min(max_age, int(remaining)))
+
+
+def get_cache_control(max_age: int = 0, immutable: bool = False) -> str:
+    """Get the `Cache-Control` header for a public response.
+
+    Args:
+        max_age (int, optional): How long the response can be cached for, in
+            seconds. Defaults to 0.
+        immutable (bool, optional): Whether the response will never change
+            while it can be cached. Defaults to False.
+
+    Returns:
+        str: The value of the header.
+    """
+    cache_control = "public, max-age={}".format(max_age)
+    if immutable:
+        cache_control += ", immutable"
+
+    return cache_control
+
+
+def get_cache_headers(etag: str,
+                      last_modified: Optional[datetime.datetime] = None,
+                      max_age: int = 0, immutable: bool = False
+                      ) -> Dict[str, str]:
+    """Get the caching headers for a response.
+
+    Args:
+        etag (str): The ETag of the response.
+        last_modified (Optional[datetime.datetime], optional): When the
+            resource was last changed. Defaults to None.
+        max_age (int, optional): How long the response can be cached for, in
+            seconds. Defaults to 0.
+        immutable (bool, optional): Whether the response will never change
+            while it can be cached. Defaults to False.
+
+    Returns:
+        Dict[str, str]: The headers.
+    """
+    headers = {"etag": etag,
+               "cache-control": get_cache_control(max_age, immutable)}
+    if last_modified is not None:
+        headers["last-modified"] = format_http_date(last_modified)
+
+    return headers
+
+
+def is_not_modified(request_headers: Mapping[str, str], etag: str,
+                    last_modified: Optional[datetime.datetime] = None
+                    ) -> bool:
+    """Check if a conditional request can be answered with a 304 response.
+
+    `If-None-Match` is used if the request has it, otherwise
+    `If-Modified-Since` is checked against the last modified date.
+
+    Args:
+        request_headers (Mapping[str, str]): The headers of the request.
+        etag (str): The ETag of the resource.
+        last_modified (Optional[datetime.datetime], optional): When the
+            resource was last changed. Defaults to None.
+
+    Returns:
+        bool: Whether the client's copy of the resource is up to date.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=datetime.timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+
+    # HTTP dates only have whole seconds
+    return last_modified.replace(microsecond=0) <= since
+
+
+def choose_encoding(accept_encoding: str, encodings: Iterable[str]) -> str:
+    """Choose the content encoding of a response.
+
+    Args:
+        accept_encoding (str): The value of the `Accept-Encoding` header.
+        encodings (Iterable[str]): The encodings that are available, in order
+            of preference.
+
+    Returns:
+        str: The best encoding that the client accepts, or "identity".
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().lower().partition(";")
+        quality = 1.0
+        name, _, value = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+
+        accepted[coding.strip()] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+
+    return "identity"
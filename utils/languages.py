@@ -1,8 +1,77 @@
 """Utilities for managing paste languages."""
+import brotli
+import gzip
+import hashlib
 import json
 import os
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
 
-language_path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                             "languages.json")
-languages = json.load(open(language_path, "r"))
-language_ids = [language["id"] for language in languages]
+language_folder = os.path.dirname(os.path.realpath(__file__))
+language_path = os.path.join(language_folder, "languages.json")
+alias_path = os.path.join(language_folder, "language_aliases.json")
+
+with open(language_path, "rb") as f:
+    languages = json.load(f)
+
+language_ids = frozenset(language["id"] for language in languages)
+
+
+def load_aliases() -> Mapping[str, str]:
+    """Build the map of names that can be used for each language.
+
+    Every language can be given by its ID or name in any case, or by one of
+    its aliases and file extensions from `language_aliases.json`.
+
+    Returns:
+        Mapping[str, str]: The ID of the language for each lowercase name.
+    """
+    aliases: Dict[str, str] = {}
+
+    with open(alias_path, "r") as f:
+        aliases.update(json.load(f))
+
+    for language in languages:
+        aliases.setdefault(language["name"].lower(), language["id"])
+    for language_id in language_ids:
+        aliases[language_id.lower()] = language_id
+
+    return MappingProxyType(aliases)
+
+
+aliases = load_aliases()
+
+
+def get_language_id(language: str) -> Optional[str]:
+    """Find the ID of a language from its ID, name, alias or file extension.
+
+    Args:
+        language (str): The language to look up, such as "python", "py" or
+            ".py".
+
+    Returns:
+        Optional[str]: The ID of the language, or None if it isn't supported.
+    """
+    return aliases.get(language.strip().lower().lstrip("."))
+
+
+def render_languages() -> Dict[str, bytes]:
+    """Render the list of languages as JSON, in every supported encoding.
+
+    Returns:
+        Dict[str, bytes]: The rendered list for each content encoding.
+    """
+    body = json.dumps(languages, separators=(",", ":")).encode("utf-8")
+    return {
+        "identity": body,
+        "gzip": gzip.compress(body, mtime=0),
+        "br": brotli.compress(body)
+    }
+
+
+rendered = render_languages()
+# Each encoding is a different representation, so it needs its own ETag
+digest = hashlib.sha256(rendered["identity"]).hexdigest()
+etags = {encoding: '"{}"'.format(digest if encoding == "identity"
+                                 else "{}-{}".format(digest, encoding))
+         for encoding in rendered}
@@ -1,25 +1,114 @@
 """Link generation."""
+import math
+import os
 import secrets
+from typing import Optional, Tuple
 
-WORD_LISTS = ("words/1.txt", "words/2.txt")
+words_path = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "words")
+WORD_LISTS = (os.path.join(words_path, "1.txt"),
+              os.path.join(words_path, "2.txt"))
 
 
-def generate_link(separator: str = ".") -> str:
+def load_word_lists() -> Tuple[Tuple[str, ...], ...]:
+    """Read the word lists from disk.
+
+    Returns:
+        Tuple[Tuple[str, ...], ...]: The words in each of the word lists.
+    """
+    word_lists = []
+
+    for word_list in WORD_LISTS:
+        with open(word_list, "r") as file:
+            word_lists.append(tuple(line.strip() for line in file
+                                    if line.strip()))
+
+    return tuple(word_lists)
+
+
+def get_modified_times() -> Tuple[float, ...]:
+    """Get the modification times of the word list files.
+
+    Returns:
+        Tuple[float, ...]: The modification time of each word list.
+    """
+    return tuple(os.path.getmtime(word_list) for word_list in WORD_LISTS)
+
+
+modified_times = get_modified_times()
+words = load_word_lists()
+
+
+def reload_word_lists(force: bool = False) -> bool:
+    """Reload the word lists if the files have changed since they were read.
+
+    Args:
+        force (bool, optional): Reload the word lists even if the files have
+            not changed. Defaults to False.
+
+    Returns:
+        bool: Whether the word lists were reloaded.
+    """
+    global modified_times, words
+
+    current_times = get_modified_times()
+    if not force and current_times == modified_times:
+        return False
+
+    words = load_word_lists()
+    modified_times = current_times
+    return True
+
+
+def get_capacity(extension: Optional[str] = None, digits: int = 3) -> int:
+    """Get the number of different links that can be generated.
+
+    Args:
+        extension (Optional[str], optional): The extension used to lengthen
+            links. Defaults to None.
+        digits (int, optional): The number of digits in a number extension.
+            Defaults to 3.
+
+    Returns:
+        int: The number of possible links.
+    """
+    capacity = math.prod(len(word_list) for word_list in words)
+
+    if extension == "word":
+        capacity *= len(words[0])
+    elif extension == "number":
+        capacity *= 10 ** digits
+
+    return capacity
+
+
+def generate_link(separator: str = ".", extension: Optional[str] = None,
+                  digits: int = 3) -> str:
     """Generate a short link.
 
     Args:
         separator (str, optional): The separator character between the words.
             Defaults to ".".
+        extension (Optional[str], optional): Lengthen the link with an extra
+            word from the first word list ("word") or with a number
+            ("number"). Defaults to None.
+        digits (int, optional): The maximum number of digits in a number
+            extension. Defaults to 3.
+
+    Raises:
+        ValueError: If the extension is not supported.
 
     Returns:
         str: The generated link.
     """
-    output = []
+    output = [secrets.choice(word_list) for word_list in words]
 
-    for word_list in WORD_LISTS:
-        with open(word_list, "r") as file:
-            words = file.readlines()
-            output.append(secrets.choice(words).strip())
+    if extension == "word":
+        output.insert(0, secrets.choice(words[0]))
+    elif extension == "number":
+        output.append(str(secrets.randbelow(10 ** digits)))
+    elif extension is not None:
+        raise ValueError("Unsupported link extension '{}'".format(extension))
 
     return separator.join(output)
 
@@ -1,22 +1,136 @@
 """Upload handling functions."""
-from tempfile import SpooledTemporaryFile
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+import fcntl
+import hashlib
 import os
+from typing import IO, Iterator, Optional, Tuple, Union
 from config import settings
 
+CHUNK_SIZE = 1024 * 1024
+BLOB_LOCK_FILE = ".blobs.lock"
 
-def save_upload(file: SpooledTemporaryFile, filename: str) -> None:
-    """Save a given uploaded file into the upload folder.
 
-    Args:
-        file (SpooledTemporaryFile): The uploaded file.
-        filename (str): The name to store the file as.
+class UploadTooLargeError(Exception):
+    """Error for when an uploaded file is larger than the allowed size."""
+
+
+def get_uploads_folder() -> str:
+    """Get the upload folder, creating it if it doesn't exist.
+
+    Returns:
+        str: The path of the upload folder.
     """
     uploads_folder = settings.uploads.folder
     if not os.path.exists(uploads_folder):
-        os.makedirs(uploads_folder)
+        os.makedirs(uploads_folder, exist_ok=True)
+
+    return uploads_folder
+
+
+@contextmanager
+def blob_lock(exclusive: bool = False) -> Iterator[None]:
+    """Hold the lock on the stored files.
+
+    Uploads hold the lock shared while they store a file and commit the
+    upload that uses it, and the cleanup holds it exclusively while it checks
+    which files are unused and removes them. This way a file is never removed
+    just after a new upload started using it.
+
+    Args:
+        exclusive (bool, optional): Whether to hold the lock exclusively.
+            Defaults to False.
+    """
+    with open(os.path.join(get_uploads_folder(), BLOB_LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def receive_upload(file: Union[SpooledTemporaryFile, IO],
+                   max_size: Optional[int] = None) -> Tuple[str, str, int]:
+    """Copy an uploaded file into the upload folder, hashing it on the way.
+
+    The file is read and written one chunk at a time into a temporary file,
+    which should then be passed to `save_upload` or `discard_upload`.
+
+    Args:
+        file (Union[SpooledTemporaryFile, IO]): The uploaded file.
+        max_size (Optional[int], optional): The maximum size of the file in
+            bytes. Defaults to None.
+
+    Raises:
+        UploadTooLargeError: If the file is larger than `max_size`. Nothing
+            is kept in the upload folder.
+
+    Returns:
+        Tuple[str, str, int]: The path of the temporary file, the SHA256 hash
+            of the file and the size of the file in bytes.
+    """
+    file_hash = hashlib.sha256()
+    size = 0
 
-    with open(os.path.join(uploads_folder, filename), "wb") as f:
-        f.writelines(file.readlines())
+    f = NamedTemporaryFile("wb", dir=get_uploads_folder(), prefix=".",
+                           suffix=".part", delete=False)
+    try:
+        with f:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                file_hash.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+
+                if max_size is not None and size > max_size:
+                    raise UploadTooLargeError()
+    except BaseException:
+        discard_upload(f.name)
+        raise
+
+    return f.name, file_hash.hexdigest(), size
+
+
+def get_blob_name(file_hash: str) -> str:
+    """Get the name that a file is stored under in the upload folder.
+
+    Files are stored by their hash so that identical files are only stored
+    once. They are spread over nested folders so that no single folder holds
+    too many files.
+
+    Args:
+        file_hash (str): The SHA256 hash of the file.
+
+    Returns:
+        str: The name of the file, relative to the upload folder.
+    """
+    return os.path.join(file_hash[:2], file_hash[2:4], file_hash)
+
+
+def save_upload(temp_path: str, filename: str) -> None:
+    """Move a received upload into place in the upload folder.
+
+    If a file is already stored with the same name, it is replaced.
+
+    Args:
+        temp_path (str): The path of the temporary file from `receive_upload`.
+        filename (str): The name to store the file as.
+    """
+    path = get_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+
+
+def discard_upload(temp_path: str) -> None:
+    """Delete a received upload that isn't needed.
+
+    Args:
+        temp_path (str): The path of the temporary file from `receive_upload`.
+    """
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
 
 
 def get_path(filename: str) -> str:
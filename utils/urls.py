@@ -0,0 +1,23 @@
+"""URL handling functions."""
+from functools import lru_cache
+import hashlib
+from typing import Tuple
+from url_normalize import url_normalize
+from config import settings
+
+
+@lru_cache(maxsize=settings.cache.url_size)
+def normalize_url(url: str) -> Tuple[str, str]:
+    """Normalise a URL and hash it, for storing and finding shortened URLs.
+
+    Results are kept in an LRU cache, as the same URLs are often shortened
+    over and over again.
+
+    Args:
+        url (str): The URL to normalise.
+
+    Returns:
+        Tuple[str, str]: The normalised URL and its SHA256 hash.
+    """
+    normalized = url_normalize(url)
+    return normalized, hashlib.sha256(normalized.encode("utf8")).hexdigest()